@@ -1,5 +1,17 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.signals import request_finished, request_started
+from django.db.backends.signals import connection_created
 
 
 class ApiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        from . import checks, signals  # noqa: F401
+        from .db import (check_connections, sqlite_immediate_transactions,
+                         touch_connections)
+        connection_created.connect(sqlite_immediate_transactions)
+        if settings.DB_CONN_HEALTH_CHECKS:
+            request_started.connect(check_connections)
+            request_finished.connect(touch_connections)
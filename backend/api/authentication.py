@@ -0,0 +1,105 @@
+import copy
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from prometheus_client import Counter
+from rest_framework.authentication import TokenAuthentication
+
+TOKEN_CACHE = Counter('foodgram_token_cache', 'Кэш токенов', ['result'])
+
+
+def version_key(key):
+    return f'auth:token:{key}:version'
+
+
+def get_version(key):
+    version = cache.get(version_key(key))
+    if version is None:
+        cache.add(
+            version_key(key), uuid.uuid4().hex,
+            settings.AUTH_TOKEN_CACHE_TIMEOUT
+        )
+        return cache.get(version_key(key))
+    return version
+
+
+class TokenCache:
+    '''LRU токенов в памяти процесса: ключ токена -> (пользователь,
+    токен, версия, когда устареет). Версия токена лежит в общем кэше,
+    поэтому выход или смена пароля в одном воркере видны в остальных
+    без запроса к БД. Включается только с общим кэшем (api.E002).
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key, version):
+        '''(пользователь, токен) или None, если записи нет, она
+        устарела или версия токена сменилась
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+            if (
+                entry is None
+                or entry[2] != version
+                or entry[3] < time.monotonic()
+            ):
+                self.entries.pop(key, None)
+                TOKEN_CACHE.labels('misses').inc()
+                return None
+            self.entries.move_to_end(key)
+            TOKEN_CACHE.labels('hits').inc()
+            return entry[:2]
+
+    def set(self, key, user, token, version):
+        expires = time.monotonic() + settings.AUTH_TOKEN_CACHE_TIMEOUT
+        with self.lock:
+            self.entries[key] = (user, token, version, expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > settings.AUTH_TOKEN_CACHE_SIZE:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, keys):
+        '''Новая версия токенов после коммита: до него другие запросы
+        еще читают из БД старые данные и кэшировали бы их с новой версией
+        '''
+        keys = list(keys)
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+        def bump():
+            cache.set_many(
+                {version_key(key): uuid.uuid4().hex for key in keys},
+                settings.AUTH_TOKEN_CACHE_TIMEOUT
+            )
+
+        transaction.on_commit(bump)
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    '''TokenAuthentication без запроса к БД, пока токен в кэше'''
+
+    def authenticate_credentials(self, key):
+        if not settings.AUTH_TOKEN_CACHE_SIZE:
+            return super().authenticate_credentials(key)
+        # версию берем до чтения из БД, иначе пропустим выход,
+        # случившийся между чтением и записью в кэш
+        version = get_version(key)
+        entry = token_cache.get(key, version)
+        if entry is not None:
+            user, token = entry
+        else:
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(key, user, token, version)
+        # представления могут менять request.user
+        return copy.copy(user), token
@@ -0,0 +1,61 @@
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+class CatalogCache:
+    '''Кэш готовых ответов для справочника (теги, ингредиенты).
+    Все ключи содержат версию справочника. Сигналы меняют версию,
+    и старые ответы просто перестают читаться. Счетчики попаданий
+    и промахов тоже лежат в кэше, чтобы их видели все воркеры.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.version_key = f'catalog:{name}:version'
+
+    def get_version(self):
+        version = cache.get(self.version_key)
+        if version is None:
+            cache.add(self.version_key, uuid.uuid4().hex, None)
+            return cache.get(self.version_key)
+        return version
+
+    def invalidate(self):
+        '''Новая версия справочника'''
+        cache.set(self.version_key, uuid.uuid4().hex, None)
+
+    def get_or_set(self, key, build, timeout=None):
+        '''Возвращаем (данные, попали ли в кэш).
+        timeout по умолчанию CATALOG_CACHE_TIMEOUT.
+        '''
+        key = f'catalog:{self.name}:{self.get_version()}:{key}'
+        payload = cache.get(key)
+        if payload is not None:
+            self.count('hits')
+            return payload, True
+        self.count('misses')
+        payload = build()
+        if timeout is None:
+            timeout = settings.CATALOG_CACHE_TIMEOUT
+        cache.set(key, payload, timeout)
+        return payload, False
+
+    def count(self, counter):
+        key = f'catalog:{self.name}:{counter}'
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+    def stats(self):
+        return {
+            counter: cache.get(f'catalog:{self.name}:{counter}', 0)
+            for counter in ('hits', 'misses')
+        }
+
+
+tag_catalog = CatalogCache('tags')
+ingredient_catalog = CatalogCache('ingredients')
@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    '''В продакшене несколько воркеров, кэш должен быть общим'''
+    if settings.SHARED_CACHE:
+        return []
+    return [Warning(
+        'Кэш в памяти процесса: воркеры не видят сброс кэша друг друга, '
+        'поэтому ответы хранятся в кэше не дольше '
+        f'{settings.LOCAL_CACHE_MAX_TIMEOUT} с.',
+        hint='Укажите общий CACHE_BACKEND, например FileBasedCache '
+        'или Memcached.',
+        id='api.W001',
+    )]
+
+
+@register(Tags.database, Tags.caches)
+def check_replica_cache(app_configs, **kwargs):
+    '''Отметка о недавней записи должна быть видна всем воркерам,
+    иначе следующий запрос в другой воркер прочитает отставшую реплику
+    '''
+    if (
+        not settings.REPLICA_DATABASES
+        or not settings.DB_REPLICA_STICKY_SECONDS
+        or settings.SHARED_CACHE
+    ):
+        return []
+    return [Error(
+        'Реплики включены, а кэш свой в каждом процессе: другие воркеры '
+        'не узнают, что пользователь только что сохранил изменения.',
+        hint='Укажите общий CACHE_BACKEND или DB_REPLICA_STICKY_SECONDS=0.',
+        id='api.E001',
+    )]
+
+
+@register(Tags.security, Tags.caches)
+def check_token_cache(app_configs, **kwargs):
+    '''Выход и смена пароля должны сбрасывать кэш токенов во всех
+    воркерах, а версия токена лежит в кэше
+    '''
+    if not settings.AUTH_TOKEN_CACHE_SIZE or settings.SHARED_CACHE:
+        return []
+    return [Error(
+        'Кэш токенов включен, а кэш свой в каждом процессе: отозванный '
+        'токен останется действительным в других воркерах.',
+        hint='Укажите общий CACHE_BACKEND или AUTH_TOKEN_CACHE_SIZE=0.',
+        id='api.E002',
+    )]
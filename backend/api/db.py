@@ -0,0 +1,119 @@
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Реплика, с которой читает текущий запрос, None - основная БД
+read_database = ContextVar('read_database', default=None)
+
+
+def check_connections(**kwargs):
+    '''Закрываем оборванные постоянные соединения до начала запроса,
+    чтобы запрос не упал на первом обращении к БД. Новое соединение
+    откроется само при первом запросе. Проверка - лишний запрос к БД,
+    поэтому проверяем только соединения, которые простояли без дела
+    дольше DB_CONN_HEALTH_CHECK_IDLE секунд: обрывают обычно их.
+    '''
+    now = time.monotonic()
+    for connection in connections.all():
+        if (
+            connection.connection is not None
+            and not connection.in_atomic_block
+            and now - getattr(connection, 'last_request_at', float('-inf'))
+            > settings.DB_CONN_HEALTH_CHECK_IDLE
+            and not connection.is_usable()
+        ):
+            connection.close()
+
+
+def touch_connections(**kwargs):
+    '''Запоминаем, когда соединение последний раз обслужило запрос'''
+    now = time.monotonic()
+    for connection in connections.all():
+        if connection.connection is not None:
+            connection.last_request_at = now
+
+
+def begin_immediate(execute, sql, params, many, context):
+    '''SQLite: транзакция сразу берет блокировку записи. Иначе
+    транзакция, которая начала с чтения, на первой записи получает
+    "database is locked" без ожидания, если кто-то уже пишет.
+    '''
+    if sql == 'BEGIN':
+        sql = 'BEGIN IMMEDIATE'
+    return execute(sql, params, many, context)
+
+
+def sqlite_immediate_transactions(sender, connection, **kwargs):
+    '''Обертка должна быть первой: execute_wrapper() снимает
+    с конца списка свою
+    '''
+    if (
+        connection.vendor == 'sqlite'
+        and begin_immediate not in connection.execute_wrappers
+    ):
+        connection.execute_wrappers.insert(0, begin_immediate)
+
+
+class ReplicaRouter:
+    '''Запись всегда в основную БД. Чтение - с реплики, только если
+    представление само включило ее через use_replica.
+    '''
+
+    def db_for_read(self, model, **hints):
+        return read_database.get()
+
+    def db_for_write(self, model, **hints):
+        # иначе объект, прочитанный с реплики, сохранялся бы в нее же
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        '''На репликах те же данные, что и в основной БД'''
+        return True
+
+
+def use_replica():
+    '''Направляем чтения на случайную реплику, если они есть.
+    Возвращаем токен для reset_replica.
+    '''
+    if not settings.REPLICA_DATABASES:
+        return None
+    return read_database.set(random.choice(settings.REPLICA_DATABASES))
+
+
+def reset_replica(token):
+    if token is not None:
+        read_database.reset(token)
+
+
+@contextmanager
+def use_primary():
+    '''Внутри блока читаем из основной БД. Так заполняются общие кэши:
+    ответ с отставшей реплики остался бы в кэше и после того, как
+    реплика догонит основную БД.
+    '''
+    token = read_database.set(None)
+    try:
+        yield
+    finally:
+        read_database.reset(token)
+
+
+def sticky_key(user):
+    return f'db:primary:{user.pk}'
+
+
+def mark_write(user):
+    '''Пока реплики догоняют, пользователь читает из основной БД
+    и видит свои изменения
+    '''
+    if settings.REPLICA_DATABASES and settings.DB_REPLICA_STICKY_SECONDS:
+        cache.set(sticky_key(user), True, settings.DB_REPLICA_STICKY_SECONDS)
+
+
+def recently_wrote(user):
+    return user.is_authenticated and cache.get(sticky_key(user), False)
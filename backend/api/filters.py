@@ -1,6 +1,7 @@
 from django.contrib.auth import get_user_model
 from django_filters.rest_framework import FilterSet, filters
 from recipes.models import Ingredient, Recipe, Tag
+from recipes.search import search
 
 User = get_user_model()
 
@@ -26,6 +27,7 @@ class RecipesFilter(FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         method="filter_for_is_in_shopping_cart"
     )
+    search = filters.CharFilter(method="filter_search")
 
     class Meta:
         model = Recipe
@@ -44,3 +46,7 @@ class RecipesFilter(FilterSet):
         if value and not request.is_anonymous:
             return queryset.filter(cart__user=request)
         return queryset
+
+    def filter_search(self, queryset, name, value):
+        '''Полнотекстовый поиск по названию и описанию'''
+        return search(queryset, value)
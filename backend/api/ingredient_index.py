@@ -0,0 +1,87 @@
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db.models import Count
+from recipes.models import Ingredient
+
+from .catalog_cache import ingredient_catalog
+from .db import use_primary
+
+
+def load_rows():
+    '''Каталог с количеством рецептов для каждого ингредиента,
+    отсортированный по названию
+    '''
+    return sorted(
+        (name.lower(), -popularity, name, pk, measurement_unit)
+        for pk, name, measurement_unit, popularity
+        in Ingredient.objects.annotate(
+            popularity=Count('ingredient')
+        ).values_list('id', 'name', 'measurement_unit', 'popularity')
+    )
+
+
+class IngredientIndex:
+    '''Префиксный индекс ингредиентов.
+    Названия хранятся в отсортированном списке, поиск по префиксу -
+    два bisect. Строки каталога собираются из БД один раз на все воркеры
+    и лежат в общем кэше, в памяти процесса только готовый индекс.
+    Индекс перестраивается лениво: когда сигнал сменил версию
+    справочника ингредиентов или прошло INGREDIENT_INDEX_TTL секунд,
+    за которые могла поменяться популярность ингредиентов.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.index = ([], [])
+        self.version = None
+        self.built_at = None
+
+    def is_stale(self):
+        if self.built_at is None:
+            return True
+        if time.monotonic() - self.built_at > settings.INGREDIENT_INDEX_TTL:
+            return True
+        return ingredient_catalog.get_version() != self.version
+
+    def build(self):
+        version = ingredient_catalog.get_version()
+        rows, _ = ingredient_catalog.get_or_set(
+            'index', load_rows, settings.INGREDIENT_INDEX_TTL
+        )
+        self.index = (
+            [row[0] for row in rows],
+            [
+                (popularity, {
+                    'id': pk,
+                    'name': name,
+                    'measurement_unit': measurement_unit
+                })
+                for _, popularity, name, pk, measurement_unit in rows
+            ]
+        )
+        self.version = version
+        self.built_at = time.monotonic()
+
+    def search(self, prefix):
+        '''Ингредиенты, название которых начинается с prefix.
+        Сначала самые популярные в рецептах.
+        '''
+        if self.is_stale():
+            with self.lock, use_primary():
+                if self.is_stale():
+                    self.build()
+        keys, ingredients = self.index
+        prefix = prefix.lower()
+        start = bisect_left(keys, prefix)
+        end = bisect_left(keys, prefix + '\U0010ffff', start)
+        return [
+            ingredient for _, ingredient in sorted(
+                ingredients[start:end], key=lambda item: item[0]
+            )
+        ]
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,189 @@
+import base64
+import http.client
+import io
+import json
+import time
+from urllib.parse import quote
+
+from PIL import Image
+
+# Меняется при любом изменении сценариев, тогда старый базовый
+# замер не сравнивается с новым
+SCENARIOS_VERSION = 1
+
+# Пароль пользователей, под которыми входят виртуальные клиенты
+PASSWORD = 'load-test-password'
+
+
+def recipe_image():
+    '''Картинка рецепта в base64, как ее присылает фронтенд'''
+    image = Image.new('RGB', (640, 480))
+    image.putdata([
+        (x * 255 // 640, y * 255 // 480, (x + y) % 256)
+        for y in range(480) for x in range(640)
+    ])
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=85)
+    return 'data:image/jpeg;base64,' + base64.b64encode(
+        buffer.getvalue()
+    ).decode()
+
+
+class Session:
+    '''Один виртуальный пользователь со своим keep-alive соединением.
+    Каждый запрос записывается под именем эндпоинта.
+    '''
+
+    def __init__(self, port, email, record, timeout):
+        self.port = port
+        self.email = email
+        self.record = record
+        self.timeout = timeout
+        self.token = None
+        self.client = None
+
+    def call(self, method, url, endpoint, expected, body=None):
+        '''Возвращаем разобранный JSON ответа или None'''
+        headers = {}
+        if self.token:
+            headers['Authorization'] = f'Token {self.token}'
+        if body is not None:
+            body = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        start = time.perf_counter()
+        try:
+            content, status = self.send(method, url, body, headers)
+        except (OSError, http.client.HTTPException):
+            self.close()
+            content, status = b'', None
+        self.record(
+            f'{method} {endpoint}',
+            time.perf_counter() - start,
+            status == expected
+        )
+        if status != expected or not content:
+            return None
+        try:
+            return json.loads(content)
+        except ValueError:
+            return None
+
+    def send(self, method, url, body, headers):
+        '''keep-alive соединение мог закрыть воркер, которого gunicorn
+        перезапустил по max_requests. Как и браузер, повторяем запрос
+        один раз в новом соединении.
+        '''
+        if self.client is not None:
+            try:
+                return self.request(method, url, body, headers)
+            except ConnectionError:
+                self.close()
+        return self.request(method, url, body, headers)
+
+    def request(self, method, url, body, headers):
+        if self.client is None:
+            self.client = http.client.HTTPConnection(
+                '127.0.0.1', self.port, timeout=self.timeout
+            )
+        self.client.request(method, quote(url, safe='/?=&'), body, headers)
+        response = self.client.getresponse()
+        return response.read(), response.status
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+
+def login(session, rnd, data):
+    response = session.call(
+        'POST', '/api/auth/token/login/', '/api/auth/token/login/', 200,
+        {'email': session.email, 'password': PASSWORD}
+    )
+    if response:
+        session.token = response['auth_token']
+
+
+def browse(session, rnd, data):
+    '''Аноним листает ленту, фильтрует по тегам и открывает рецепты'''
+    token, session.token = session.token, None
+    try:
+        session.call(
+            'GET', '/api/tags/', '/api/tags/', 200
+        )
+        session.call(
+            'GET', f'/api/recipes/?page={rnd.randint(1, 5)}',
+            '/api/recipes/?page', 200
+        )
+        tags = '&'.join(
+            f'tags={slug}' for slug in rnd.sample(data['tags'], 2)
+        )
+        session.call(
+            'GET', f'/api/recipes/?{tags}', '/api/recipes/?tags', 200
+        )
+        for _ in range(2):
+            session.call(
+                'GET', f'/api/recipes/{rnd.choice(data["recipes"])}/',
+                '/api/recipes/{id}/', 200
+            )
+    finally:
+        session.token = token
+
+
+def toggle(session, rnd, data):
+    '''Добавляем рецепт в избранное или корзину и убираем'''
+    kind = rnd.choice(('favorite', 'shopping_cart'))
+    url = f'/api/recipes/{rnd.choice(data["recipes"])}/{kind}/'
+    endpoint = f'/api/recipes/{{id}}/{kind}/'
+    session.call('POST', url, endpoint, 201)
+    session.call('DELETE', url, endpoint, 204)
+
+
+def create_recipe(session, rnd, data):
+    '''Создаем рецепт с картинкой, смотрим его и удаляем'''
+    recipe = session.call(
+        'POST', '/api/recipes/', '/api/recipes/', 201, {
+            'name': f'Нагрузочный рецепт {rnd.randint(1, 10 ** 6)}',
+            'text': 'Описание рецепта',
+            'cooking_time': rnd.randint(5, 120),
+            'tags': rnd.sample(data['tag_ids'], 2),
+            'ingredients': [
+                {'id': ingredient_id, 'amount': rnd.randint(1, 500)}
+                for ingredient_id in rnd.sample(data['ingredients'], 5)
+            ],
+            'image': data['image'],
+        }
+    )
+    if recipe:
+        url = f'/api/recipes/{recipe["id"]}/'
+        session.call('GET', url, '/api/recipes/{id}/', 200)
+        session.call('DELETE', url, '/api/recipes/{id}/', 204)
+
+
+def subscriptions(session, rnd, data):
+    '''Листаем подписки'''
+    for page in (1, 2):
+        session.call(
+            'GET', f'/api/users/subscriptions/?page={page}&recipes_limit=3',
+            '/api/users/subscriptions/', 200
+        )
+
+
+def download(session, rnd, data):
+    '''Скачиваем список покупок'''
+    file_format = rnd.choice(('txt', 'csv', 'pdf'))
+    session.call(
+        'GET', f'/api/recipes/download_shopping_cart/?format={file_format}',
+        f'/api/recipes/download_shopping_cart/?format={file_format}', 200
+    )
+
+
+# Сценарий: (функция, вес, нужен ли вход)
+JOURNEYS = (
+    (browse, 50, False),
+    (toggle, 20, True),
+    (subscriptions, 10, True),
+    (download, 5, True),
+    (create_recipe, 5, True),
+    (login, 5, False),
+)
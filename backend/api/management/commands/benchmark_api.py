@@ -0,0 +1,443 @@
+import random
+import statistics
+import tempfile
+import time
+
+from api.nplusone import QueryDetector
+from api.pagination import RecipeCursorPagination
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (CaptureQueriesContext, override_settings,
+                               setup_test_environment,
+                               teardown_test_environment)
+from recipes.cart_totals import refresh_cart_totals
+from recipes.counters import recount
+from recipes.models import (Bookmark, Cart, Ingredient, IngredientForRecipe,
+                            Recipe, Tag)
+from recipes.search import rebuild_index
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from users.models import Subscription, User
+
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAIAAACQd1PeAAAAD'
+    'ElEQVR4nGP4//8/AAX+Av4N70a4AAAAAElFTkSuQmCC'
+)
+
+PAGE_SIZE = settings.REST_FRAMEWORK['PAGE_SIZE']
+
+# Максимальное количество SQL запросов на один запрос к API.
+# Для создания и изменения рецепта сюда входит обработка картинки,
+# которая в бенчмарке выполняется сразу, а не в фоне. Изменение корзины
+# сразу пересчитывает готовые итоги списка покупок, удаление из избранного
+# и корзины сначала выбирает удаляемые строки. Токен берется из кэша,
+# запроса к таблице токенов нет.
+QUERY_BUDGETS = {
+    'tags-list': 2,
+    'ingredients-list': 1,
+    'users-list': 2,
+    'users-me': 1,
+    'recipes-list-anonymous': 4,
+    'recipes-list': 5,
+    'recipes-list-deep': 5,
+    'recipes-list-cursor': 4,
+    'recipes-list-tags': 6,
+    'recipes-search': 5,
+    'recipes-retrieve': 4,
+    'recipes-create': 24,
+    'recipes-update': 29,
+    'recipes-update-name': 13,
+    'favorite-add': 4,
+    'favorite-remove': 4,
+    'shopping-cart-add': 8,
+    'shopping-cart-remove': 8,
+    'shopping-cart-add-many': 8,
+    'shopping-cart-remove-many': 8,
+    'subscribe': 4,
+    'unsubscribe': 3,
+    'users-subscriptions': 3,
+    'users-subscriptions-cursor': 2,
+    'download-shopping-cart': 1,
+}
+
+# Число запросов на страницу не должно зависеть от ее размера:
+# данные для всех объектов страницы берутся одним запросом.
+# Размер страницы рецептов задается только при пагинации по курсору.
+PAGE_SIZE_CHECKS = (
+    ('recipes-list-cursor', '/api/recipes/?cursor=&limit={}'),
+    ('recipes-favorited', '/api/recipes/?cursor=&is_favorited=1&limit={}'),
+    ('recipes-author',
+     '/api/recipes/?cursor=&author={author}&limit={}'),
+    ('users-list', '/api/users/?limit={}'),
+    ('users-subscriptions',
+     '/api/users/subscriptions/?limit={}&recipes_limit=3'),
+)
+PAGE_SIZES = (1, 5, 20)
+
+
+class Command(BaseCommand):
+    '''Замеряем количество SQL запросов и время ответа эндпоинтов API'''
+    help = (
+        'Заполняет тестовую БД данными и замеряет количество запросов, '
+        'время в БД и общее время для каждого эндпоинта'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--recipes', type=int, default=300)
+        parser.add_argument('--ingredients', type=int, default=2000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--no-fail',
+            action='store_true',
+            help='Не падать при превышении лимита запросов'
+        )
+        parser.add_argument(
+            '--nplusone',
+            choices=('raise', 'log', 'off'),
+            default='raise',
+            help='Что делать с повторяющимися запросами (N+1)'
+        )
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0,
+            autoclobber=True,
+            serialize=False
+        )
+        try:
+            with tempfile.TemporaryDirectory() as media_root:
+                # тестовая БД в памяти не видна из фоновых потоков,
+                # реплики смотрят в настоящие базы,
+                # N+1 ищем здесь, а не в middleware,
+                # бенчмарк идет в одном процессе, кэш токенов включаем
+                # и с кэшем в памяти
+                with override_settings(
+                    MEDIA_ROOT=media_root,
+                    RECIPE_IMAGE_BACKGROUND=False,
+                    REPLICA_DATABASES=[],
+                    NPLUSONE_MODE='off',
+                    AUTH_TOKEN_CACHE_SIZE=10000
+                ):
+                    data = self.seed(**options)
+                    results = self.run_scenarios(
+                        data, options['repeat'], options['nplusone']
+                    )
+                    page_sizes = self.check_page_sizes(data)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        self.report(
+            results, options['no_fail'], options['nplusone'], page_sizes
+        )
+
+    def seed(self, users, recipes, ingredients, seed, **kwargs):
+        '''Заполняем БД данными похожими на реальные'''
+        rnd = random.Random(seed)
+        Tag.objects.bulk_create(
+            Tag(name=name, color=color, slug=slug)
+            for name, color, slug in (
+                ('Завтрак', '#1A85FF', 'breakfast'),
+                ('Обед', '#D41159', 'dinner'),
+                ('Ужин', '#FFC20A', 'supper'),
+                ('Перекус', '#0ACF83', 'snack'),
+            )
+        )
+        tags = list(Tag.objects.all())
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'ингредиент {i}', measurement_unit='г')
+            for i in range(ingredients)
+        )
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+        User.objects.bulk_create(
+            User(
+                username=f'user{i}',
+                email=f'user{i}@foodgram.ru',
+                first_name='Имя',
+                last_name='Фамилия',
+                password='!'
+            )
+            for i in range(users)
+        )
+        authors = list(User.objects.order_by('id'))
+        # Популярные авторы пишут больше рецептов
+        weights = [1 / (rank + 1) for rank in range(len(authors))]
+        Recipe.objects.bulk_create(
+            Recipe(
+                name=f'рецепт {i}',
+                author=rnd.choices(authors, weights)[0],
+                text='Описание рецепта',
+                image='recipes/benchmark.png',
+                cooking_time=rnd.randint(1, 120)
+            )
+            for i in range(recipes)
+        )
+        recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe_id=recipe_id, tag_id=tag.id)
+            for recipe_id in recipe_ids
+            for tag in rnd.sample(tags, rnd.randint(1, 2))
+        )
+        IngredientForRecipe.objects.bulk_create(
+            IngredientForRecipe(
+                recipe_id=recipe_id,
+                ingredient_id=ingredient_id,
+                amount=rnd.randint(1, 500)
+            )
+            for recipe_id in recipe_ids
+            for ingredient_id in rnd.sample(ingredient_ids, rnd.randint(3, 10))
+        )
+        user = authors[-1]
+        followed = authors[:users // 2]
+        Subscription.objects.bulk_create(
+            Subscription(subscriber=user, author=author)
+            for author in followed
+        )
+        chosen = rnd.sample(recipe_ids, len(recipe_ids) // 2)
+        favorites, cart, free = chosen[::2], chosen[1::2], [
+            recipe_id for recipe_id in recipe_ids if recipe_id not in chosen
+        ]
+        Bookmark.objects.bulk_create(
+            Bookmark(user=user, recipe_id=recipe_id)
+            for recipe_id in favorites
+        )
+        Cart.objects.bulk_create(
+            Cart(user=user, recipe_id=recipe_id) for recipe_id in cart[:20]
+        )
+        recount()
+        refresh_cart_totals([user.id])
+        rebuild_index()
+        return {
+            'user': user,
+            'token': Token.objects.create(user=user).key,
+            'tags': [tag.id for tag in tags],
+            'ingredients': ingredient_ids,
+            'recipes': recipe_ids,
+            'free_recipes': free,
+            'not_followed': [author.id for author in authors[users // 2:-1]],
+            'top_author': authors[0].id,
+        }
+
+    def recipe_payload(self, data, i):
+        '''Тело запроса для создания и изменения рецепта'''
+        return {
+            'ingredients': [
+                {'id': ingredient_id, 'amount': 10 + i}
+                for ingredient_id in data['ingredients'][i:i + 5]
+            ],
+            'tags': data['tags'][:2],
+            'image': IMAGE,
+            'name': f'Новый рецепт {i}',
+            'text': 'Описание',
+            'cooking_time': 15,
+        }
+
+    def scenarios(self, data):
+        '''Сценарии: имя, метод, url, тело, ожидаемый статус, авторизация'''
+        recipes = data['recipes']
+        free = data['free_recipes']
+        authors = data['not_followed']
+        own = []
+        # одна и та же глубокая страница ленты по номеру и по курсору
+        pagination = RecipeCursorPagination()
+        depth = len(recipes) // 2
+        deep_page = depth // PAGE_SIZE + 1
+        deep = Recipe.objects.order_by(*pagination.ordering)[
+            (deep_page - 1) * PAGE_SIZE - 1
+        ]
+        cursor = pagination.make_cursor(False, pagination.get_position(deep))
+        return (
+            ('tags-list', 'get', lambda i: '/api/tags/', None, 200, True),
+            ('ingredients-list', 'get',
+             lambda i: '/api/ingredients/?name=ингредиент 1', None, 200, True),
+            ('users-list', 'get', lambda i: '/api/users/', None, 200, True),
+            ('users-me', 'get', lambda i: '/api/users/me/', None, 200, True),
+            ('recipes-list-anonymous', 'get',
+             lambda i: f'/api/recipes/?page={i + 1}', None, 200, False),
+            ('recipes-list', 'get',
+             lambda i: f'/api/recipes/?page={i + 1}', None, 200, True),
+            ('recipes-list-deep', 'get',
+             lambda i: f'/api/recipes/?page={deep_page}', None, 200, True),
+            ('recipes-list-cursor', 'get',
+             lambda i: f'/api/recipes/?cursor={cursor}', None, 200, True),
+            ('recipes-list-tags', 'get',
+             lambda i: '/api/recipes/?tags=breakfast&tags=dinner',
+             None, 200, True),
+            ('recipes-search', 'get',
+             lambda i: f'/api/recipes/?search=рецепт {i + 1}',
+             None, 200, True),
+            ('recipes-retrieve', 'get',
+             lambda i: f'/api/recipes/{recipes[i]}/', None, 200, True),
+            ('recipes-create', 'post', lambda i: '/api/recipes/',
+             lambda i: self.recipe_payload(data, i), 201, True),
+            ('recipes-update', 'patch',
+             lambda i: f'/api/recipes/{own[i]}/',
+             lambda i: self.recipe_payload(data, i + 1), 200, True),
+            ('recipes-update-name', 'patch',
+             lambda i: f'/api/recipes/{own[i]}/',
+             lambda i: {'name': f'Переименованный рецепт {i}'}, 200, True),
+            ('favorite-add', 'post',
+             lambda i: f'/api/recipes/{free[i]}/favorite/', None, 201, True),
+            ('favorite-remove', 'delete',
+             lambda i: f'/api/recipes/{free[i]}/favorite/', None, 204, True),
+            ('shopping-cart-add', 'post',
+             lambda i: f'/api/recipes/{free[i]}/shopping_cart/',
+             None, 201, True),
+            ('shopping-cart-remove', 'delete',
+             lambda i: f'/api/recipes/{free[i]}/shopping_cart/',
+             None, 204, True),
+            ('shopping-cart-add-many', 'post',
+             lambda i: '/api/recipes/shopping_cart/',
+             lambda i: {'recipes': free[i * 10:(i + 1) * 10]}, 201, True),
+            ('shopping-cart-remove-many', 'delete',
+             lambda i: '/api/recipes/shopping_cart/',
+             lambda i: {'recipes': free[i * 10:(i + 1) * 10]}, 204, True),
+            ('subscribe', 'post',
+             lambda i: f'/api/users/{authors[i]}/subscribe/',
+             None, 201, True),
+            ('unsubscribe', 'delete',
+             lambda i: f'/api/users/{authors[i]}/subscribe/',
+             None, 204, True),
+            ('users-subscriptions', 'get',
+             lambda i: '/api/users/subscriptions/?recipes_limit=3',
+             None, 200, True),
+            ('users-subscriptions-cursor', 'get',
+             lambda i: '/api/users/subscriptions/?cursor=&recipes_limit=3',
+             None, 200, True),
+            ('download-shopping-cart', 'get',
+             lambda i: '/api/recipes/download_shopping_cart/',
+             None, 200, True),
+        ), own
+
+    def run_scenarios(self, data, repeat, nplusone='raise'):
+        '''Выполняем каждый сценарий repeat раз и собираем замеры'''
+        client = APIClient()
+        scenarios, own = self.scenarios(data)
+        results = []
+        for name, method, url, payload, expected, auth in scenarios:
+            if auth:
+                client.credentials(HTTP_AUTHORIZATION=f'Token {data["token"]}')
+            else:
+                client.credentials()
+            walls, db_times, counts, errors = [], [], [], []
+            duplicates = None
+            for i in range(repeat):
+                body = payload(i) if payload else None
+                detector = QueryDetector()
+                with CaptureQueriesContext(connection) as queries:
+                    with detector.watch():
+                        start = time.perf_counter()
+                        response = getattr(client, method)(
+                            url(i), body, format='json'
+                        )
+                        if hasattr(response, 'streaming_content'):
+                            b''.join(response.streaming_content)
+                        walls.append(time.perf_counter() - start)
+                db_times.append(
+                    sum(float(query['time']) for query in queries)
+                )
+                counts.append(len(queries))
+                if nplusone != 'off' and detector.duplicates():
+                    duplicates = detector.report(name)
+                if response.status_code != expected:
+                    errors.append(response.status_code)
+                elif name == 'recipes-create':
+                    own.append(response.data['id'])
+            results.append({
+                'name': name,
+                'wall': statistics.median(walls) * 1000,
+                'db': statistics.median(db_times) * 1000,
+                'queries': max(counts),
+                'budget': QUERY_BUDGETS.get(name),
+                'errors': errors,
+                'nplusone': duplicates,
+            })
+        return results
+
+    def check_page_sizes(self, data):
+        '''Запрашиваем страницы из PAGE_SIZES объектов.
+        Возвращаем [(сценарий, {размер: запросов})], None - страница
+        не заполнилась и сравнивать нечего.
+        '''
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {data["token"]}')
+        # первый запрос кладет токен в кэш
+        client.get('/api/users/me/')
+        checks = []
+        for name, url in PAGE_SIZE_CHECKS:
+            counts = {}
+            for size in PAGE_SIZES:
+                with CaptureQueriesContext(connection) as queries:
+                    response = client.get(
+                        url.format(size, author=data['top_author'])
+                    )
+                full = (
+                    response.status_code == 200
+                    and len(response.data['results']) == size
+                )
+                counts[size] = len(queries) if full else None
+            checks.append((name, counts))
+        return checks
+
+    def report_page_sizes(self, checks):
+        '''Печатаем запросы по размерам страниц, возвращаем ошибки'''
+        self.stdout.write(
+            f'{"запросы на страницу из":<26}'
+            + ''.join(f'{size:>7}' for size in PAGE_SIZES)
+        )
+        failed = []
+        for name, counts in checks:
+            line = f'{name:<26}' + ''.join(
+                f'{"-" if count is None else count:>7}'
+                for count in counts.values()
+            )
+            if None in counts.values():
+                failed.append(f'{name}: страница не заполнилась')
+                line = self.style.ERROR(line)
+            elif len(set(counts.values())) > 1:
+                failed.append(
+                    f'{name}: число запросов растет с размером страницы'
+                )
+                line = self.style.ERROR(line)
+            self.stdout.write(line)
+        return failed
+
+    def report(self, results, no_fail, nplusone='raise', page_sizes=()):
+        '''Печатаем таблицу замеров и проверяем лимиты запросов'''
+        self.stdout.write(
+            f'{"сценарий":<26}{"запросы":>9}{"лимит":>7}'
+            f'{"БД, мс":>10}{"всего, мс":>11}'
+        )
+        failed = []
+        for result in results:
+            budget = result['budget']
+            line = (
+                f'{result["name"]:<26}{result["queries"]:>9}'
+                f'{budget if budget is not None else "-":>7}'
+                f'{result["db"]:>10.2f}{result["wall"]:>11.2f}'
+            )
+            if result['errors']:
+                failed.append(
+                    f'{result["name"]}: неожиданный статус {result["errors"]}'
+                )
+                line = self.style.ERROR(line)
+            elif result['nplusone']:
+                self.stderr.write(result['nplusone'])
+                if nplusone == 'raise':
+                    failed.append(f'{result["name"]}: N+1')
+                    line = self.style.ERROR(line)
+            elif budget is not None and result['queries'] > budget:
+                failed.append(
+                    f'{result["name"]}: {result["queries"]} запросов '
+                    f'при лимите {budget}'
+                )
+                line = self.style.ERROR(line)
+            self.stdout.write(line)
+        failed.extend(self.report_page_sizes(page_sizes))
+        if failed and not no_fail:
+            raise CommandError('\n'.join(failed))
+        self.stdout.write(self.style.SUCCESS('Замеры завершены'))
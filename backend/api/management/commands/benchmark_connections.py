@@ -0,0 +1,72 @@
+import statistics
+import time
+
+from django.core.management import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import connection
+from django.db.backends.signals import connection_created
+
+
+class Command(BaseCommand):
+    '''Замеряем цену открытия соединения с БД на каждый запрос.
+    Запросы имитируются сигналами начала и конца запроса, как в
+    обработчике Django, внутри - один SELECT 1. Для каждого
+    CONN_MAX_AGE выводим, сколько соединений открылось и сколько
+    в среднем занял запрос.
+    '''
+    help = 'Сравнивает запросы с постоянными и новыми соединениями с БД'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument(
+            '--max-age',
+            type=int,
+            nargs='+',
+            default=[0, 60],
+            help='Значения CONN_MAX_AGE для сравнения'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f'{"CONN_MAX_AGE":<14}{"соединений":>12}'
+            f'{"среднее, мс":>13}{"p99, мс":>10}'
+        )
+        for max_age in options['max_age']:
+            result = self.run(max_age, options['requests'])
+            self.stdout.write(
+                f'{max_age:<14}{result["connections"]:>12}'
+                f'{result["mean"]:>13.3f}{result["p99"]:>10.3f}'
+            )
+        self.stdout.write(self.style.SUCCESS('Замер завершен'))
+
+    def run(self, max_age, requests):
+        opened = []
+
+        def count(sender, connection, **kwargs):
+            opened.append(connection.alias)
+
+        connection.close()
+        old_max_age = connection.settings_dict['CONN_MAX_AGE']
+        connection.settings_dict['CONN_MAX_AGE'] = max_age
+        connection_created.connect(count)
+        timings = []
+        try:
+            for _ in range(requests):
+                start = time.perf_counter()
+                request_started.send(sender=self.__class__)
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                    cursor.fetchone()
+                request_finished.send(sender=self.__class__)
+                timings.append(time.perf_counter() - start)
+        finally:
+            connection_created.disconnect(count)
+            connection.close()
+            connection.settings_dict['CONN_MAX_AGE'] = old_max_age
+        timings.sort()
+        return {
+            'connections': len(opened),
+            'mean': statistics.mean(timings) * 1000,
+            'p99': timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+            * 1000,
+        }
@@ -0,0 +1,14 @@
+from api.catalog_cache import ingredient_catalog, tag_catalog
+from django.core.management import BaseCommand
+
+
+class Command(BaseCommand):
+    '''Показываем попадания и промахи кэша справочников'''
+
+    def handle(self, *args, **kwargs):
+        for catalog in (tag_catalog, ingredient_catalog):
+            stats = catalog.stats()
+            self.stdout.write(
+                f'{catalog.name}: попаданий {stats["hits"]}, '
+                f'промахов {stats["misses"]}'
+            )
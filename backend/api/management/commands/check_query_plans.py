@@ -0,0 +1,200 @@
+import re
+
+from api.filters import RecipesFilter
+from api.pagination import RecipeCursorPagination
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Exists, F, OuterRef
+from django.test import RequestFactory
+from django.test.utils import setup_test_environment, teardown_test_environment
+from recipes.models import (Bookmark, Cart, CartTotal, IngredientForRecipe,
+                            Recipe)
+from users.models import Subscription, User
+
+from .benchmark_api import Command as BenchmarkCommand
+
+
+class Command(BaseCommand):
+    '''Проверяем, что горячие запросы обслуживаются индексами.
+    На SQLite смотрим EXPLAIN QUERY PLAN и ищем полный SCAN таблицы,
+    на PostgreSQL выключаем Seq Scan и ищем его в EXPLAIN.
+    '''
+    help = 'Проверяет планы запросов фильтров и вьюсетов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--recipes', type=int, default=300)
+        parser.add_argument('--ingredients', type=int, default=500)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--verbose-plans',
+            action='store_true',
+            help='Печатать планы целиком'
+        )
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0,
+            autoclobber=True,
+            serialize=False
+        )
+        try:
+            data = BenchmarkCommand().seed(**options)
+            failed = self.check_plans(data, options['verbose_plans'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        if failed:
+            raise CommandError('\n'.join(failed))
+        self.stdout.write(self.style.SUCCESS('Все запросы идут по индексам'))
+
+    def queries(self, data):
+        '''Запросы из RecipesFilter и вьюсетов: имя, queryset, таблицы,
+        которые нельзя читать целиком, и должен ли индекс давать порядок
+        '''
+        user = data['user']
+        author = Recipe.objects.exclude(author=user).first().author
+        request = RequestFactory().get('/api/recipes/')
+        request.user = user
+        recipe_ids = list(Recipe.objects.values_list('id', flat=True)[:6])
+        pagination = RecipeCursorPagination()
+        middle = Recipe.objects.order_by(*pagination.ordering)[
+            Recipe.objects.count() // 2
+        ]
+        return (
+            (
+                'лента по курсору',
+                Recipe.objects.order_by(*pagination.ordering).filter(
+                    pagination.after(
+                        pagination.ordering,
+                        [middle.pub_date, middle.id]
+                    )
+                )[:pagination.page_size + 1],
+                ('recipes_recipe',),
+                True,
+            ),
+            (
+                'страница автора',
+                RecipesFilter(
+                    data={'author': author.id},
+                    queryset=Recipe.objects.all(),
+                    request=request
+                ).qs,
+                ('recipes_recipe',),
+                True,
+            ),
+            (
+                'поиск по тексту',
+                RecipesFilter(
+                    data={'search': 'рецепт 1'},
+                    queryset=Recipe.objects.all(),
+                    request=request
+                ).qs,
+                ('recipes_recipe',),
+                False,
+            ),
+            (
+                'фильтр по тегам',
+                RecipesFilter(
+                    data={'tags': ['breakfast', 'dinner']},
+                    queryset=Recipe.objects.all(),
+                    request=request
+                ).qs,
+                ('recipes_recipe_tags',),
+                False,
+            ),
+            (
+                'ингредиенты страницы рецептов',
+                IngredientForRecipe.objects.filter(
+                    recipe_id__in=recipe_ids
+                ).select_related('ingredient'),
+                ('recipes_ingredientforrecipe', 'recipes_ingredient'),
+                False,
+            ),
+            (
+                'теги страницы рецептов',
+                Recipe.tags.through.objects.filter(
+                    recipe_id__in=recipe_ids
+                ).select_related('tag'),
+                ('recipes_recipe_tags', 'recipes_tag'),
+                False,
+            ),
+            (
+                'избранное и корзина пользователя',
+                Recipe.objects.filter(id__in=recipe_ids).annotate(
+                    is_favorited=Exists(Bookmark.objects.filter(
+                        user=user, recipe=OuterRef('pk')
+                    )),
+                    is_in_shopping_cart=Exists(Cart.objects.filter(
+                        user=user, recipe=OuterRef('pk')
+                    ))
+                ),
+                ('recipes_bookmark', 'recipes_cart'),
+                False,
+            ),
+            (
+                'подписчики автора',
+                Subscription.objects.filter(author=author).values(
+                    'subscriber'
+                ),
+                ('users_subscription',),
+                False,
+            ),
+            (
+                'подписки пользователя',
+                User.objects.filter(author__subscriber=user),
+                ('users_subscription',),
+                False,
+            ),
+            (
+                'список покупок',
+                CartTotal.objects.filter(user=user).values(
+                    'measurement_unit',
+                    'amount',
+                    name=F('ingredient__name')
+                ),
+                ('recipes_carttotal', 'recipes_ingredient'),
+                False,
+            ),
+        )
+
+    def check_plans(self, data, verbose):
+        failed = []
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = off')
+        for name, queryset, tables, ordered in self.queries(data):
+            plan = queryset.explain()
+            if verbose:
+                self.stdout.write(f'{name}:\n{plan}\n')
+            scanned = [
+                table for table in tables
+                if self.is_full_scan(plan, table)
+            ]
+            if ordered and self.is_sorted(plan):
+                scanned.append('сортировка без индекса')
+            if scanned:
+                failed.append(
+                    f'{name}: полное чтение {", ".join(scanned)}\n{plan}'
+                )
+                self.stdout.write(self.style.ERROR(f'{name}: без индекса'))
+            else:
+                self.stdout.write(f'{name}: по индексу')
+        return failed
+
+    def is_sorted(self, plan):
+        if connection.vendor == 'postgresql':
+            return re.search(r'\bSort\b', plan) is not None
+        return re.search(
+            r'USE TEMP B-TREE FOR (RIGHT PART OF )?ORDER BY', plan
+        ) is not None
+
+    def is_full_scan(self, plan, table):
+        if connection.vendor == 'postgresql':
+            return re.search(rf'Seq Scan on {table}\b', plan) is not None
+        # SCAN table без USING INDEX - чтение всей таблицы
+        return re.search(
+            rf'\bSCAN (TABLE )?{table}\b(?!.*USING)', plan
+        ) is not None
@@ -0,0 +1,174 @@
+import os
+import shutil
+import tempfile
+import time
+
+from django.core.cache import cache
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import connection, connections
+from django.test.utils import (CaptureQueriesContext, override_settings,
+                               setup_test_environment,
+                               teardown_test_environment)
+from recipes.models import Ingredient, Recipe, Tag
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from users.models import User
+
+from .benchmark_api import Command as BenchmarkCommand
+
+REPLICA = 'replica'
+
+
+class Command(BaseCommand):
+    '''Проверяем роутер реплик на двух SQLite базах. Реплика - копия
+    основной базы на момент заполнения, поэтому все изменения после
+    копирования видны только в основной, как у отставшей реплики.
+    '''
+    help = 'Проверяет, какие запросы к API читают с реплики'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sticky-seconds',
+            type=int,
+            default=1,
+            help='Сколько секунд читать из основной БД после записи'
+        )
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        connection.close()
+        old_settings = dict(connection.settings_dict)
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                primary = os.path.join(directory, 'primary.sqlite3')
+                connection.settings_dict.update(
+                    ENGINE='django.db.backends.sqlite3',
+                    NAME=primary
+                )
+                call_command('migrate', verbosity=0)
+                data = BenchmarkCommand().seed(
+                    users=10, recipes=50, ingredients=100, seed=42
+                )
+                connection.close()
+                replica = os.path.join(directory, 'replica.sqlite3')
+                shutil.copy(primary, replica)
+                connections.databases[REPLICA] = {
+                    **connection.settings_dict,
+                    'NAME': replica
+                }
+                try:
+                    with override_settings(
+                        REPLICA_DATABASES=[REPLICA],
+                        DB_REPLICA_STICKY_SECONDS=options['sticky_seconds'],
+                        RECIPE_IMAGE_BACKGROUND=False
+                    ):
+                        cache.clear()
+                        results = self.run_checks(
+                            data, options['sticky_seconds']
+                        )
+                finally:
+                    connections[REPLICA].close()
+                    del connections.databases[REPLICA]
+                    connection.close()
+        finally:
+            connection.settings_dict.update(old_settings)
+            teardown_test_environment()
+        self.report(results)
+
+    def request(self, client, method, url):
+        '''Ответ и число SQL запросов в основную БД и в реплику'''
+        with CaptureQueriesContext(connection) as primary:
+            with CaptureQueriesContext(connections[REPLICA]) as replica:
+                response = getattr(client, method)(url, format='json')
+        return response, len(primary), len(replica)
+
+    def run_checks(self, data, sticky_seconds):
+        user = APIClient()
+        user.credentials(HTTP_AUTHORIZATION=f'Token {data["token"]}')
+        other = APIClient()
+        other.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(
+            user=User.objects.exclude(pk=data['user'].pk).first()
+        ).key)
+        recipe = f'/api/recipes/{data["free_recipes"][0]}/'
+        results = []
+
+        response, primary, replica = self.request(
+            APIClient(), 'get', '/api/recipes/'
+        )
+        results.append((
+            'кэш списка для анонимов заполняется из основной БД',
+            response.status_code == 200 and primary and not replica
+        ))
+        results.extend(self.check_cache_fills(data))
+        response, primary, replica = self.request(user, 'get', recipe)
+        results.append((
+            'пользователь читает рецепт с реплики',
+            response.status_code == 200 and replica
+        ))
+        response, primary, replica = self.request(
+            user, 'post', recipe + 'favorite/'
+        )
+        results.append((
+            'добавление в избранное пишет в основную БД',
+            response.status_code == 201 and primary and not replica
+        ))
+        response, primary, replica = self.request(user, 'get', recipe)
+        results.append((
+            'после записи пользователь читает из основной БД',
+            response.data['is_favorited'] and not replica
+        ))
+        response, primary, replica = self.request(other, 'get', recipe)
+        results.append((
+            'другой пользователь читает с реплики',
+            response.status_code == 200 and replica
+        ))
+        time.sleep(sticky_seconds + 0.5)
+        response, primary, replica = self.request(user, 'get', recipe)
+        results.append((
+            'после окна пользователь снова читает с реплики',
+            # реплика не знает про избранное, она отстала
+            not response.data['is_favorited'] and replica
+        ))
+        return results
+
+    def check_cache_fills(self, data):
+        '''Изменения есть только в основной БД, реплика их не знает.
+        Кэши после сброса должны заполниться уже с изменениями.
+        '''
+        anonymous = APIClient()
+        anonymous.get('/api/tags/')
+        anonymous.get('/api/ingredients/?name=ингр')
+        recipe = Recipe.objects.get(pk=data['free_recipes'][1])
+        url = f'/api/recipes/{recipe.pk}/'
+        anonymous.get(url)
+
+        Tag.objects.create(name='Новый тег', color='#000000', slug='new')
+        Ingredient.objects.create(name='ингр новый', measurement_unit='г')
+        recipe.name = 'Переименованный рецепт'
+        recipe.save()
+        tags = anonymous.get('/api/tags/').json()
+        ingredients = anonymous.get('/api/ingredients/?name=ингр').json()
+        detail = anonymous.get(url).json()
+        return [
+            (
+                'новый тег виден в кэше тегов',
+                'new' in {tag['slug'] for tag in tags}
+            ),
+            (
+                'новый ингредиент находится автодополнением',
+                'ингр новый' in {item['name'] for item in ingredients}
+            ),
+            (
+                'новое название рецепта видно в кэше рецепта',
+                detail['name'] == recipe.name
+            ),
+        ]
+
+    def report(self, results):
+        failed = 0
+        for name, passed in results:
+            self.stdout.write(f'{"ok  " if passed else "FAIL"}  {name}')
+            failed += not passed
+        if failed:
+            raise CommandError(f'Проверок не прошло: {failed}')
+        self.stdout.write(self.style.SUCCESS('Роутер реплик работает'))
@@ -0,0 +1,303 @@
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import connection
+
+from .benchmark_api import Command as BenchmarkCommand
+
+# Режим: аргументы gunicorn для запуска приложения.
+# gthread - настройки продакшена из gunicorn.conf.py.
+SERVERS = {
+    'wsgi': ['foodgram.wsgi:application', '--worker-class', 'sync'],
+    'gthread': ['foodgram.wsgi:application'],
+    'asgi': [
+        'foodgram.asgi:application',
+        '--worker-class', 'uvicorn.workers.UvicornWorker',
+    ],
+}
+
+# Эндпоинты только для чтения, которые дергаем анонимно
+URLS = (
+    '/api/tags/',
+    '/api/ingredients/?name=ингредиент 1',
+    '/api/recipes/',
+    '/api/recipes/?page=2',
+)
+
+# Список покупок отдается потоком, тело ответа должно совпадать
+# на всех серверах
+DOWNLOADS = ('txt', 'csv', 'pdf')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def request(port, url, timeout):
+    '''GET запрос: (статус, время ответа в секундах)'''
+    start = time.perf_counter()
+    client = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        client.request('GET', quote(url, safe='/?=&'))
+        response = client.getresponse()
+        response.read()
+        status = response.status
+    except OSError:
+        status = None
+    finally:
+        client.close()
+    return status, time.perf_counter() - start
+
+
+def download(port, token, file_format):
+    '''Список покупок: (статус, тело), статус None - ответ оборвался'''
+    client = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    try:
+        client.request(
+            'GET',
+            f'/api/recipes/download_shopping_cart/?format={file_format}',
+            headers={'Authorization': f'Token {token}'}
+        )
+        response = client.getresponse()
+        return response.status, response.read()
+    except (OSError, http.client.HTTPException):
+        return None, b''
+    finally:
+        client.close()
+
+
+def slow_upload(port, token, stop):
+    '''Медленный клиент: отправляет тело POST по байту в секунду.
+    Запрос авторизован, поэтому сервер ждет тело целиком.
+    '''
+    try:
+        with socket.create_connection(('127.0.0.1', port), timeout=5) as sock:
+            sock.sendall(
+                b'POST /api/recipes/ HTTP/1.1\r\n'
+                b'Host: 127.0.0.1\r\n'
+                b'Authorization: Token ' + token.encode() + b'\r\n'
+                b'Content-Type: application/json\r\n'
+                b'Content-Length: 1048576\r\n\r\n'
+            )
+            while not stop.wait(1):
+                sock.sendall(b' ')
+    except OSError:
+        pass
+
+
+@contextmanager
+def sqlite_database(db_name):
+    '''Временно переключаем default на новую SQLite базу с миграциями.
+    Подменить можно только файл: класс соединения уже выбран по DB_ENGINE.
+    '''
+    if connection.vendor != 'sqlite':
+        raise CommandError(
+            'Замер идет на временной SQLite базе, запустите команду '
+            'с DB_ENGINE=django.db.backends.sqlite3'
+        )
+    connection.close()
+    old_settings = dict(connection.settings_dict)
+    connection.settings_dict.update(
+        ENGINE='django.db.backends.sqlite3',
+        NAME=db_name
+    )
+    try:
+        call_command('migrate', verbosity=0)
+        yield
+    finally:
+        connection.close()
+        connection.settings_dict.update(old_settings)
+
+
+@contextmanager
+def serve(name, db_name, workers, env=None):
+    '''Запускаем gunicorn с настройками из gunicorn.conf.py
+    на SQLite базе db_name и возвращаем порт.
+    env - дополнительные переменные окружения сервера.
+    '''
+    port = free_port()
+    env = {
+        **os.environ,
+        'DB_ENGINE': 'django.db.backends.sqlite3',
+        'DB_NAME': db_name,
+        'DB_REPLICAS': '',
+        'GUNICORN_ACCESS_LOG': '',
+        **(env or {}),
+    }
+    server = subprocess.Popen(
+        [
+            sys.executable, '-m', 'gunicorn.app.wsgiapp', *SERVERS[name],
+            '--config', 'gunicorn.conf.py',
+            '--bind', f'127.0.0.1:{port}',
+            '--workers', str(workers),
+            '--log-level', 'warning',
+        ],
+        cwd=settings.BASE_DIR,
+        env=env
+    )
+    try:
+        wait_for(server, port)
+        yield port
+    finally:
+        server.terminate()
+        server.wait(10)
+
+
+def wait_for(server, port):
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise CommandError('Сервер не запустился')
+        if request(port, URLS[0], 1)[0] == 200:
+            return
+        time.sleep(0.2)
+    raise CommandError('Сервер не ответил за 30 секунд')
+
+
+def percentile(values, share):
+    '''values отсортированы'''
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+class Command(BaseCommand):
+    '''Сравниваем WSGI и ASGI под одинаковой нагрузкой.
+    Обе версии запускаются в gunicorn с одинаковым числом воркеров
+    на заранее заполненной SQLite базе, клиенты в потоках запрашивают
+    эндпоинты только для чтения. Медленные клиенты имитируют загрузку
+    картинок по плохой сети.
+    '''
+    help = 'Сравнивает запросы в секунду и p99 для WSGI и ASGI'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--servers',
+            nargs='+',
+            choices=SERVERS,
+            default=list(SERVERS)
+        )
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--duration', type=float, default=10)
+        parser.add_argument(
+            '--slow-clients',
+            type=int,
+            default=0,
+            help='Сколько медленных загрузок держать открытыми'
+        )
+        parser.add_argument('--timeout', type=float, default=10)
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--recipes', type=int, default=300)
+        parser.add_argument('--ingredients', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            # одинаковая база для всех серверов
+            db_name = os.path.join(directory, 'load.sqlite3')
+            with sqlite_database(db_name):
+                token = BenchmarkCommand().seed(**options)['token']
+            downloads = {}
+            results = [
+                self.run_server(name, db_name, token, options, downloads)
+                for name in options['servers']
+            ]
+        self.report(results)
+
+    def run_server(self, name, db_name, token, options, downloads):
+        stop = threading.Event()
+        with serve(name, db_name, options['workers']) as port:
+            self.check_downloads(name, port, token, downloads)
+            slow = [
+                threading.Thread(target=slow_upload, args=(port, token, stop))
+                for _ in range(options['slow_clients'])
+            ]
+            for thread in slow:
+                thread.start()
+            try:
+                result = self.load(port, options)
+            finally:
+                stop.set()
+        result['name'] = name
+        return result
+
+    def check_downloads(self, name, port, token, downloads):
+        '''Список покупок целиком и такой же, как на первом сервере.
+        PDF содержит время создания, у него проверяем только конец файла.
+        '''
+        for file_format in DOWNLOADS:
+            status, body = download(port, token, file_format)
+            if status != 200:
+                raise CommandError(
+                    f'{name}: список покупок {file_format} - {status}'
+                )
+            if file_format == 'pdf':
+                if not body.rstrip().endswith(b'%%EOF'):
+                    raise CommandError(f'{name}: PDF обрезан')
+            elif downloads.setdefault(file_format, body) != body:
+                raise CommandError(
+                    f'{name}: список покупок {file_format} отличается'
+                )
+
+    def load(self, port, options):
+        '''Клиенты по кругу запрашивают URLS до конца замера'''
+        latencies, errors = [], []
+        lock = threading.Lock()
+        deadline = time.monotonic() + options['duration']
+
+        def client(number):
+            i = number
+            while time.monotonic() < deadline:
+                status, latency = request(
+                    port, URLS[i % len(URLS)], options['timeout']
+                )
+                i += 1
+                with lock:
+                    if status == 200:
+                        latencies.append(latency)
+                    else:
+                        errors.append(status)
+
+        threads = [
+            threading.Thread(target=client, args=(number,))
+            for number in range(options['concurrency'])
+        ]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start
+        latencies.sort()
+        return {
+            'rps': len(latencies) / elapsed,
+            'p50': percentile(latencies, 0.5) * 1000,
+            'p99': percentile(latencies, 0.99) * 1000,
+            'errors': len(errors),
+        }
+
+    def report(self, results):
+        self.stdout.write(
+            f'{"сервер":<8}{"запросов/с":>12}{"p50, мс":>10}'
+            f'{"p99, мс":>10}{"ошибки":>8}'
+        )
+        for result in results:
+            self.stdout.write(
+                f'{result["name"]:<8}{result["rps"]:>12.1f}'
+                f'{result["p50"]:>10.1f}{result["p99"]:>10.1f}'
+                f'{result["errors"]:>8}'
+            )
+        self.stdout.write(self.style.SUCCESS('Сравнение завершено'))
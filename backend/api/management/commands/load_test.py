@@ -0,0 +1,301 @@
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+from api.load_scenarios import (JOURNEYS, PASSWORD, SCENARIOS_VERSION, Session,
+                                login, recipe_image)
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management import BaseCommand, CommandError
+from recipes.cart_totals import refresh_cart_totals
+from recipes.counters import recount
+from recipes.models import Cart, Tag
+from users.models import Subscription, User
+
+from .benchmark_api import Command as BenchmarkCommand
+from .compare_servers import SERVERS, percentile, serve, sqlite_database
+
+BASELINE = os.path.join(settings.BASE_DIR, 'api', 'load_baseline.json')
+
+# Настройки запуска, которые должны совпадать с базовым замером
+RUN_OPTIONS = (
+    'server', 'workers', 'concurrency', 'duration', 'users', 'recipes',
+    'ingredients', 'seed',
+)
+
+# p95 выросло меньше чем на столько миллисекунд - это шум
+P95_NOISE_MS = 25
+# По меньшему числу запросов p95 скачет от запуска к запуску
+MIN_REQUESTS = 200
+
+
+def find_regressions(baseline, result, tolerance):
+    '''Описания ухудшений по сравнению с базовым замером'''
+    regressions = []
+    old, new = baseline['total'], result['total']
+    if new['rps'] < old['rps'] * (1 - tolerance):
+        regressions.append(
+            f'всего: {new["rps"]} запросов/с, было {old["rps"]}'
+        )
+    before = {**baseline['endpoints'], 'всего': baseline['total']}
+    after = {**result['endpoints'], 'всего': result['total']}
+    for endpoint, new in after.items():
+        old = before.get(endpoint)
+        if old is None:
+            continue
+        if (
+            min(new['requests'], old['requests']) >= MIN_REQUESTS
+            and new['p95'] > old['p95'] * (1 + tolerance)
+            and new['p95'] - old['p95'] > P95_NOISE_MS
+        ):
+            regressions.append(
+                f'{endpoint}: p95 {new["p95"]} мс, было {old["p95"]}'
+            )
+        if new['error_rate'] > old['error_rate'] + 0.01:
+            regressions.append(
+                f'{endpoint}: ошибок {new["error_rate"]:.1%}, '
+                f'было {old["error_rate"]:.1%}'
+            )
+    return regressions
+
+
+class Command(BaseCommand):
+    '''Нагрузочный тест: виртуальные пользователи проходят сценарии
+    из api.load_scenarios против gunicorn на заполненной SQLite базе.
+    Для каждого эндпоинта считаем запросы в секунду, p50/p95/p99
+    и долю ошибок и сравниваем с базовым замером из load_baseline.json.
+    p95 сравниваем только у эндпоинтов с MIN_REQUESTS запросов и больше.
+    '''
+    help = 'Нагрузочный тест API со сравнением с базовым замером'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--server', choices=SERVERS, default='gthread'
+        )
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--duration', type=float, default=30)
+        parser.add_argument(
+            '--warmup',
+            type=float,
+            default=3,
+            help='Первые секунды не попадают в замер'
+        )
+        parser.add_argument('--timeout', type=float, default=10)
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--recipes', type=int, default=300)
+        parser.add_argument('--ingredients', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--baseline', default=BASELINE)
+        parser.add_argument(
+            '--save-baseline',
+            action='store_true',
+            help='Записать результат как новый базовый замер'
+        )
+        parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=0.5,
+            help='Допустимое ухудшение, доля от базового замера'
+        )
+
+    def handle(self, *args, **options):
+        if options['concurrency'] > options['users']:
+            raise CommandError('--concurrency не может быть больше --users')
+        with tempfile.TemporaryDirectory() as directory:
+            db_name = os.path.join(directory, 'load.sqlite3')
+            with sqlite_database(db_name):
+                data = self.prepare(options)
+            # картинки созданных рецептов не должны попасть в media
+            media = os.path.join(directory, 'media')
+            with serve(
+                options['server'], db_name, options['workers'],
+                {'MEDIA_ROOT': media}
+            ) as port:
+                result = self.run(port, data, options)
+        self.report(result)
+        if options['save_baseline']:
+            self.save(result, options)
+        else:
+            self.compare(result, options)
+
+    def prepare(self, options):
+        '''Данные бенчмарка, плюс у каждого виртуального пользователя
+        пароль, подписки на две страницы и корзина
+        '''
+        seed = BenchmarkCommand().seed(**options)
+        rnd = random.Random(options['seed'])
+        users = list(User.objects.order_by('id')[:options['concurrency']])
+        authors = list(User.objects.values_list('id', flat=True))
+        password = make_password(PASSWORD)
+        for user in users:
+            user.password = password
+        User.objects.bulk_update(users, ['password'])
+        Subscription.objects.bulk_create(
+            (
+                Subscription(subscriber=user, author_id=author_id)
+                for user in users
+                for author_id in rnd.sample(authors, min(13, len(authors)))
+                if author_id != user.id
+            ),
+            ignore_conflicts=True
+        )
+        Cart.objects.bulk_create(
+            (
+                Cart(user=user, recipe_id=recipe_id)
+                for user in users
+                for recipe_id in rnd.sample(seed['recipes'], 5)
+            ),
+            ignore_conflicts=True
+        )
+        recount()
+        refresh_cart_totals([user.id for user in users])
+        return {
+            'emails': [user.email for user in users],
+            'recipes': seed['recipes'],
+            'ingredients': seed['ingredients'],
+            'tag_ids': seed['tags'],
+            'tags': list(Tag.objects.values_list('slug', flat=True)),
+            'image': recipe_image(),
+        }
+
+    def run(self, port, data, options):
+        stats = {}
+        lock = threading.Lock()
+        started = time.monotonic()
+        measure_from = started + options['warmup']
+        deadline = measure_from + options['duration']
+
+        def record(endpoint, latency, ok):
+            if time.monotonic() < measure_from:
+                return
+            with lock:
+                latencies, errors = stats.setdefault(endpoint, ([], [0]))
+                latencies.append(latency)
+                errors[0] += not ok
+
+        def user(number):
+            rnd = random.Random(options['seed'] + number)
+            session = Session(
+                port, data['emails'][number], record, options['timeout']
+            )
+            journeys = [journey for journey, _, _ in JOURNEYS]
+            weights = [weight for _, weight, _ in JOURNEYS]
+            needs_login = {journey: auth for journey, _, auth in JOURNEYS}
+            try:
+                while time.monotonic() < deadline:
+                    journey = rnd.choices(journeys, weights)[0]
+                    if needs_login[journey] and session.token is None:
+                        login(session, rnd, data)
+                    journey(session, rnd, data)
+            finally:
+                session.close()
+
+        threads = [
+            threading.Thread(target=user, args=(number,))
+            for number in range(options['concurrency'])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duration = time.monotonic() - measure_from
+        endpoints = {
+            endpoint: self.summary(latencies, errors[0], duration)
+            for endpoint, (latencies, errors) in sorted(stats.items())
+        }
+        total = self.summary(
+            [
+                latency for latencies, _ in stats.values()
+                for latency in latencies
+            ],
+            sum(errors[0] for _, errors in stats.values()),
+            duration
+        )
+        return {'total': total, 'endpoints': endpoints}
+
+    def summary(self, latencies, errors, duration):
+        latencies = sorted(latencies)
+        return {
+            'requests': len(latencies),
+            'rps': round(len(latencies) / duration, 2),
+            'p50': round(percentile(latencies, 0.5) * 1000, 1),
+            'p95': round(percentile(latencies, 0.95) * 1000, 1),
+            'p99': round(percentile(latencies, 0.99) * 1000, 1),
+            'error_rate': round(errors / max(len(latencies), 1), 4),
+        }
+
+    def report(self, result):
+        self.stdout.write(
+            f'{"эндпоинт":<50}{"запросов":>9}{"в сек":>8}{"p50":>8}'
+            f'{"p95":>8}{"p99":>8}{"ошибки":>8}'
+        )
+        rows = [*result['endpoints'].items(), ('всего', result['total'])]
+        for endpoint, stats in rows:
+            self.stdout.write(
+                f'{endpoint:<50}{stats["requests"]:>9}{stats["rps"]:>8.1f}'
+                f'{stats["p50"]:>8.1f}{stats["p95"]:>8.1f}'
+                f'{stats["p99"]:>8.1f}{stats["error_rate"]:>8.1%}'
+            )
+
+    def save(self, result, options):
+        with open(options['baseline'], 'w', encoding='utf-8') as file:
+            json.dump(
+                {
+                    'version': SCENARIOS_VERSION,
+                    'options': {
+                        name: options[name] for name in RUN_OPTIONS
+                    },
+                    **result,
+                },
+                file,
+                ensure_ascii=False,
+                indent=2
+            )
+            file.write('\n')
+        self.stdout.write(self.style.SUCCESS(
+            f'Базовый замер записан в {options["baseline"]}'
+        ))
+
+    def compare(self, result, options):
+        '''Сравниваем с базовым замером, при ухудшении падаем'''
+        baseline = self.load_baseline(options)
+        if baseline is None:
+            return
+        tolerance = options['tolerance']
+        regressions = find_regressions(baseline, result, tolerance)
+        if regressions:
+            raise CommandError(
+                'Хуже базового замера:\n' + '\n'.join(regressions)
+            )
+        self.stdout.write(self.style.SUCCESS(
+            'Не хуже базового замера с допуском '
+            f'{tolerance:.0%}'
+        ))
+
+    def load_baseline(self, options):
+        '''Базовый замер или None, если сравнивать не с чем'''
+        try:
+            with open(options['baseline'], encoding='utf-8') as file:
+                baseline = json.load(file)
+        except FileNotFoundError:
+            self.stdout.write(self.style.WARNING(
+                'Базового замера нет, запишите его через --save-baseline'
+            ))
+            return None
+        if baseline['version'] != SCENARIOS_VERSION:
+            self.stdout.write(self.style.WARNING(
+                'Сценарии изменились, базовый замер нужно записать заново'
+            ))
+            return None
+        run_options = {name: options[name] for name in RUN_OPTIONS}
+        if baseline['options'] != run_options:
+            self.stdout.write(self.style.WARNING(
+                f'Настройки отличаются от базового замера '
+                f'{baseline["options"]}, сравнение пропущено'
+            ))
+            return None
+        return baseline
@@ -0,0 +1,164 @@
+import os
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from prometheus_client import (CollectorRegistry, Counter, Histogram,
+                               generate_latest, multiprocess)
+from prometheus_client.core import CounterMetricFamily
+
+from .authentication import TOKEN_CACHE
+from .catalog_cache import ingredient_catalog, tag_catalog
+
+# Границы корзин гистограммы длительности запроса, секунды
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Замеры текущего запроса, None - вне MetricsMiddleware
+request_metrics = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    '''Замеры одного запроса'''
+    __slots__ = ('view', 'queries', 'db', 'serializer', 'serializing')
+
+    def __init__(self):
+        self.view = 'other'
+        self.queries = 0
+        self.db = 0.0
+        self.serializer = 0.0
+        self.serializing = False
+
+    def execute(self, execute, sql, params, many, context):
+        '''Обертка для connection.execute_wrapper'''
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - start
+            self.queries += 1
+
+
+REQUEST_DURATION = Histogram(
+    'foodgram_request_duration_seconds', 'Время ответа', ['view'],
+    buckets=BUCKETS
+)
+DB_QUERIES = Counter('foodgram_db_queries', 'SQL запросов', ['view'])
+DB_SECONDS = Counter('foodgram_db_seconds', 'Время в БД', ['view'])
+SERIALIZER_SECONDS = Counter(
+    'foodgram_serializer_seconds', 'Время сериализации', ['view']
+)
+METRICS = (
+    REQUEST_DURATION, DB_QUERIES, DB_SECONDS, SERIALIZER_SECONDS,
+    TOKEN_CACHE,
+)
+
+
+def observe(view, duration, metrics):
+    REQUEST_DURATION.labels(view).observe(duration)
+    DB_QUERIES.labels(view).inc(metrics.queries)
+    DB_SECONDS.labels(view).inc(metrics.db)
+    SERIALIZER_SECONDS.labels(view).inc(metrics.serializer)
+
+
+class CatalogCacheCollector:
+    '''Счетчики кэша справочников лежат в кэше Django,
+    их не нужно складывать по воркерам
+    '''
+
+    def collect(self):
+        metric = CounterMetricFamily(
+            'foodgram_catalog_cache', 'Кэш справочников',
+            labels=['catalog', 'result']
+        )
+        for catalog in (tag_catalog, ingredient_catalog):
+            for result, count in catalog.stats().items():
+                metric.add_metric([catalog.name, result], count)
+        yield metric
+
+
+def render_metrics():
+    '''Метрики в текстовом формате Prometheus. С PROMETHEUS_MULTIPROC_DIR
+    каждый воркер пишет свои значения в файлы в этом каталоге,
+    здесь они складываются по всем воркерам.
+    '''
+    registry = CollectorRegistry()
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        for metric in METRICS:
+            registry.register(metric)
+    registry.register(CatalogCacheCollector())
+    return generate_latest(registry)
+
+
+def view_name(view_func, request):
+    '''RecipeViewSet.list, UserViewSet.subscriptions и т.п.'''
+    view_class = getattr(view_func, 'cls', None)
+    if view_class is None:
+        return getattr(view_func, '__name__', 'other')
+    action = (getattr(view_func, 'actions', None) or {}).get(
+        request.method.lower()
+    )
+    if action is None:
+        return view_class.__name__
+    return f'{view_class.__name__}.{action}'
+
+
+class MetricsMiddleware:
+    '''Считаем SQL запросы, время в БД, сериализаторах и общее время,
+    отдаем их в заголовке Server-Timing и копим в метриках Prometheus
+    '''
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_METRICS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = request_metrics.set(metrics)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(metrics.execute)
+                    )
+                response = self.get_response(request)
+        finally:
+            request_metrics.reset(token)
+        duration = time.perf_counter() - start
+        observe(metrics.view, duration, metrics)
+        response['Server-Timing'] = (
+            f'db;dur={metrics.db * 1000:.2f};'
+            f'desc="{metrics.queries} queries", '
+            f'serializer;dur={metrics.serializer * 1000:.2f}, '
+            f'total;dur={duration * 1000:.2f}'
+        )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = request_metrics.get()
+        if metrics is not None:
+            metrics.view = view_name(view_func, request)
+
+
+class TimedSerializerMixin:
+    '''Время to_representation внешнего сериализатора попадает
+    в замеры запроса. Вложенные сериализаторы не считаются второй раз.
+    '''
+
+    def to_representation(self, instance):
+        metrics = request_metrics.get()
+        if metrics is None or metrics.serializing:
+            return super().to_representation(instance)
+        metrics.serializing = True
+        start = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            metrics.serializer += time.perf_counter() - start
+            metrics.serializing = False
@@ -0,0 +1,138 @@
+import logging
+import os
+import re
+import sys
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from rest_framework import serializers
+
+logger = logging.getLogger(__name__)
+
+TRANSACTION = re.compile(
+    r'^\s*(BEGIN|COMMIT|ROLLBACK|SAVEPOINT|RELEASE SAVEPOINT)\b', re.I
+)
+STRINGS = re.compile(r"'(?:[^']|'')*'")
+NUMBERS = re.compile(r'\b\d+(?:\.\d+)?\b')
+IN_LISTS = re.compile(r'\bIN \((?:\?, )*\?\)', re.I)
+
+# Обертки execute_wrapper, через которые проходит запрос, - не источник
+SKIP_FILES = {
+    os.path.join(os.path.dirname(__file__), 'metrics.py'),
+    os.path.abspath(__file__),
+}
+
+
+class NPlusOneError(Exception):
+    '''Один и тот же запрос с разными параметрами повторяется'''
+
+
+def fingerprint(sql):
+    '''SQL без параметров: запросы, отличающиеся только значениями,
+    получают одинаковый отпечаток. Управление транзакциями не считаем.
+    '''
+    if TRANSACTION.match(sql):
+        return None
+    sql = STRINGS.sub('?', sql)
+    sql = NUMBERS.sub('?', sql).replace('%s', '?')
+    return IN_LISTS.sub('IN (...)', sql)
+
+
+def find_origin(frame):
+    '''Поле сериализатора и строка кода проекта, откуда пришел запрос'''
+    field = line = None
+    base_dir = str(settings.BASE_DIR)
+    while frame is not None and (field is None or line is None):
+        code = frame.f_code
+        filename = os.path.abspath(code.co_filename)
+        if (
+            line is None
+            and filename.startswith(base_dir)
+            and filename not in SKIP_FILES
+        ):
+            line = (
+                f'{os.path.relpath(filename, base_dir)}:{frame.f_lineno} '
+                f'в {code.co_name}'
+            )
+        if field is None and code.co_name in (
+            'to_representation', 'to_internal_value'
+        ):
+            serializer = frame.f_locals.get('self')
+            current = frame.f_locals.get('field')
+            if (
+                isinstance(serializer, serializers.Serializer)
+                and current is not None
+            ):
+                field = f'{type(serializer).__name__}.{current.field_name}'
+        frame = frame.f_back
+    return field, line
+
+
+class QueryDetector:
+    '''Считаем отпечатки SQL запросов. Запрос, повторенный threshold
+    раз, считается N+1, для него запоминаем источник.
+    '''
+
+    def __init__(self, threshold=None):
+        self.threshold = threshold or settings.NPLUSONE_THRESHOLD
+        self.counts = {}
+        self.origins = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        key = fingerprint(sql)
+        if key is not None:
+            count = self.counts[key] = self.counts.get(key, 0) + 1
+            if count == self.threshold:
+                self.origins[key] = find_origin(sys._getframe(1))
+        return execute(sql, params, many, context)
+
+    @contextmanager
+    def watch(self, name=None):
+        '''Следим за запросами ко всем базам внутри блока.
+        С name после блока без исключений вызываем check(name).
+        '''
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            yield self
+        if name is not None:
+            self.check(name)
+
+    def duplicates(self):
+        '''[(отпечаток, сколько раз, поле сериализатора, строка кода)]'''
+        return [
+            (key, self.counts[key], *origin)
+            for key, origin in self.origins.items()
+        ]
+
+    def report(self, name):
+        lines = [f'N+1 в {name}:']
+        for key, count, field, line in self.duplicates():
+            lines.append(
+                f'  {count} раз из {field or "кода"} ({line or "?"}): {key}'
+            )
+        return '\n'.join(lines)
+
+    def check(self, name, mode=None):
+        '''log - пишем предупреждение, raise - бросаем NPlusOneError'''
+        mode = mode or settings.NPLUSONE_MODE
+        if not self.origins or mode == 'off':
+            return
+        if mode == 'raise':
+            raise NPlusOneError(self.report(name))
+        logger.warning(self.report(name))
+
+
+class NPlusOneMiddleware:
+    '''Ищем N+1 в каждом запросе, режим задает NPLUSONE_MODE'''
+
+    def __init__(self, get_response):
+        if settings.NPLUSONE_MODE not in ('log', 'raise'):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryDetector().watch(f'{request.method} {request.path}'):
+            return self.get_response(request)
@@ -1,6 +1,160 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class UserPagination(PageNumberPagination):
     '''передаем параметр limit'''
     page_size_query_param = "limit"
+
+
+class KeysetPagination(BasePagination):
+    '''Пагинация по ключу без COUNT и OFFSET.
+    Курсор хранит значения полей ordering у крайнего объекта страницы,
+    следующая страница выбирается условием по этим полям и идет
+    по индексу с любой глубины. Последнее поле ordering должно быть
+    уникальным, иначе объекты с одинаковым ключом потеряются.
+    '''
+    ordering = ('-id',)
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Неверный курсор'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.model = queryset.model
+        cursor = self.decode_cursor(request)
+        reverse, position = cursor if cursor else (False, None)
+        ordering = self.get_ordering(reverse)
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.after(ordering, position))
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+        # идем назад только со страницы, после которой есть следующая
+        self.has_next = has_more if not reverse else True
+        self.has_previous = has_more if reverse else cursor is not None
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, reverse):
+        if not reverse:
+            return self.ordering
+        return tuple(
+            field[1:] if field.startswith('-') else f'-{field}'
+            for field in self.ordering
+        )
+
+    def after(self, ordering, position):
+        '''Условие "строго после position" для сортировки ordering:
+        a <= x AND ((a < x) OR (a = x AND b < y) OR ...).
+        Нестрогое условие по первому полю позволяет БД начать
+        чтение индекса сразу с нужного места.
+        '''
+        condition = Q()
+        equal = {}
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        first = ordering[0]
+        lookup = 'lte' if first.startswith('-') else 'gte'
+        return Q(**{f'{first.lstrip("-")}__{lookup}': position[0]}) & condition
+
+    def get_position(self, obj):
+        return [
+            obj._meta.get_field(field.lstrip('-')).value_to_string(obj)
+            for field in self.ordering
+        ]
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(False, self.get_position(self.page[-1]))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(True, self.get_position(self.page[0]))
+
+    def make_cursor(self, reverse, position):
+        raw = json.dumps({'r': reverse, 'p': position})
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    def encode_cursor(self, reverse, position):
+        cursor = self.make_cursor(reverse, position)
+        url = self.request.build_absolute_uri()
+        # номер страницы с курсором не нужен
+        url = remove_query_param(url, 'page')
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        '''Пустой курсор - первая страница'''
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            raw = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            values = raw['p']
+            if len(values) != len(self.ordering):
+                raise ValueError
+            position = [
+                self.model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, values)
+            ]
+            return bool(raw['r']), position
+        except (KeyError, TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+class RecipeCursorPagination(KeysetPagination):
+    '''Лента рецептов: новые сверху, id различает рецепты
+    с одинаковой датой
+    '''
+    ordering = ('-pub_date', '-id')
+
+
+class SubscriptionCursorPagination(KeysetPagination):
+    '''Подписки пользователя по id автора'''
+    ordering = ('id',)
@@ -0,0 +1,134 @@
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from recipes.models import Recipe
+
+# Параметры, от которых зависит ответ для анонимного пользователя
+LIST_PARAMS = ('author', 'cursor', 'limit', 'page', 'search', 'tags')
+
+
+class RecipeCache:
+    '''Кэш ответов списка и страницы рецепта для анонимных пользователей.
+    Каждый ответ зависит от набора областей со своими версиями:
+    recipe:<id> для страницы рецепта, author:<id> для списка
+    с фильтром по автору, tag:<slug> для списка с фильтром по тегам
+    и all для списка без фильтров. Сигналы меняют версии только
+    тех областей, в которые попадает измененный рецепт. Область global
+    есть у всех ответов, ее меняем при изменении тегов.
+    '''
+
+    def versions(self, scopes):
+        keys = [f'recipes:version:{scope}' for scope in scopes]
+        versions = cache.get_many(keys)
+        for key in keys:
+            if key not in versions:
+                cache.add(key, uuid.uuid4().hex, None)
+                versions[key] = cache.get(key)
+        return [versions[key] for key in keys]
+
+    def bump(self, scopes):
+        cache.set_many(
+            {
+                f'recipes:version:{scope}': uuid.uuid4().hex
+                for scope in scopes
+            },
+            None
+        )
+
+    def list_scopes(self, params):
+        if params.get('author'):
+            return [f'author:{author}' for author in params['author']]
+        if params.get('tags'):
+            return [f'tag:{slug}' for slug in params['tags']]
+        return ['all']
+
+    def get_key(self, request, kind, scopes, params=()):
+        '''Ключ из адреса сайта, параметров запроса и версий областей'''
+        raw = repr((
+            request.build_absolute_uri('/'),
+            kind,
+            sorted(params),
+            self.versions(['global', *scopes]),
+        ))
+        return f'recipes:{kind}:{hashlib.md5(raw.encode()).hexdigest()}'
+
+    def get(self, key):
+        return cache.get(key)
+
+    def set(self, key, kind, content):
+        timeout = (
+            settings.RECIPE_CACHE_LIST_TIMEOUT if kind == 'list'
+            else settings.RECIPE_CACHE_DETAIL_TIMEOUT
+        )
+        cache.set(key, content, timeout)
+
+    def list_params(self, request):
+        '''Нормализуем параметры списка: порядок и лишние параметры
+        не должны давать разные ключи
+        '''
+        return {
+            name: sorted(set(request.query_params.getlist(name)))
+            for name in LIST_PARAMS
+            if request.query_params.getlist(name)
+        }
+
+
+class PendingInvalidation:
+    '''Области и рецепты, которые надо сбросить после коммита.
+    За одну транзакцию копим все изменения и меняем версии один раз.
+    '''
+
+    def __init__(self):
+        self.scopes = set()
+        self.recipe_ids = set()
+
+    def __call__(self):
+        connection = transaction.get_connection()
+        if getattr(connection, 'recipe_cache_pending', None) is self:
+            connection.recipe_cache_pending = None
+        scopes = set(self.scopes)
+        if self.recipe_ids:
+            scopes.update(recipe_scopes(self.recipe_ids))
+        if scopes:
+            recipe_cache.bump(scopes)
+
+
+def recipe_scopes(recipe_ids):
+    '''Все области, в которые попадают рецепты'''
+    scopes = {'all'}
+    for recipe_id, author_id in Recipe.objects.filter(
+        id__in=recipe_ids
+    ).values_list('id', 'author_id'):
+        scopes.add(f'recipe:{recipe_id}')
+        scopes.add(f'author:{author_id}')
+    scopes.update(
+        f'tag:{slug}' for slug in Recipe.tags.through.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('tag__slug', flat=True)
+    )
+    return scopes
+
+
+def invalidate(scopes=(), recipe_ids=()):
+    '''Сбрасываем кэш после коммита текущей транзакции'''
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        pending = PendingInvalidation()
+    else:
+        pending = getattr(connection, 'recipe_cache_pending', None)
+        # после отката транзакции отложенный вызов пропадает
+        if pending is None or pending not in (
+            func for _, func in connection.run_on_commit
+        ):
+            pending = connection.recipe_cache_pending = PendingInvalidation()
+            transaction.on_commit(pending)
+    pending.scopes.update(scopes)
+    pending.recipe_ids.update(recipe_ids)
+    if not connection.in_atomic_block:
+        pending()
+
+
+recipe_cache = RecipeCache()
@@ -0,0 +1,48 @@
+import json
+
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BaseRenderer
+
+
+class ShoppingCartRenderer(BaseRenderer):
+    '''Базовый рендер для выгрузки списка покупок.
+    Сам файл отдается StreamingHttpResponse, поэтому рендер
+    нужен для выбора формата через ?format= и для вывода ошибок.
+    '''
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+
+class PlainTextRenderer(ShoppingCartRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+
+class CSVRenderer(ShoppingCartRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class PDFRenderer(ShoppingCartRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+
+
+class FormatNegotiation(DefaultContentNegotiation):
+    '''Формат файла выбирается только параметром ?format=,
+    без него - первый рендер. Заголовок Accept не учитываем:
+    клиенты просят application/json, а ждут файл.
+    '''
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        file_format = format_suffix or request.query_params.get(
+            self.settings.URL_FORMAT_OVERRIDE
+        )
+        if file_format:
+            renderers = self.filter_renderers(renderers, file_format)
+        return renderers[0], renderers[0].media_type
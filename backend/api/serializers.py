@@ -1,27 +1,48 @@
 import webcolors
 from django.contrib.auth import get_user_model
 from django.db import transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from drf_extra_fields.fields import Base64ImageField
-from recipes.models import Cart, Ingredient, IngredientForRecipe, Recipe, Tag
+from recipes.cart_totals import ingredients_changed_in_recipe
+from recipes.images import (delete_variant_files, schedule_variants,
+                            variant_urls)
+from recipes.models import Ingredient, IngredientForRecipe, Recipe, Tag
+from recipes.signals import bulk_changes
 from rest_framework import serializers
 from users.models import Subscription
 
+from .metrics import TimedSerializerMixin
+from .recipe_cache import invalidate
+
 User = get_user_model()
 
+# Сколько рецептов можно добавить или удалить одним запросом
+MAX_BULK_RECIPES = 100
+
 
-class UserSerializer(UserSerializer):
+class UserSerializer(TimedSerializerMixin, UserSerializer):
     '''Сериализатор для User'''
     is_subscribed = serializers.SerializerMethodField(read_only=True)
 
     def get_is_subscribed(self, obj):
-        '''Возвращаем True если юзер подписан на автора'''
-        user = self.context.get('request').user
-        if not user or user.is_anonymous:
+        '''Возвращаем True если юзер подписан на автора.
+        Берем аннотацию из queryset, а если ее нет - множество
+        id авторов, которое запрашиваем один раз на запрос.
+        '''
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        request = self.context.get('request')
+        if not request or request.user.is_anonymous:
             return False
-        return Subscription.objects.filter(
-            subscriber=user,
-            author=obj).exists()
+        if not hasattr(request, 'subscribed_ids'):
+            request.subscribed_ids = set(
+                Subscription.objects.filter(
+                    subscriber=request.user
+                ).values_list('author_id', flat=True)
+            )
+        return obj.id in request.subscribed_ids
 
     class Meta:
         model = User
@@ -73,7 +94,7 @@ class HexColorForTag(serializers.Field):
             raise serializers.ValidationError("Для этого цвета нет имени")
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     '''Сериализатор для тегов'''
     color = HexColorForTag
 
@@ -87,7 +108,8 @@ class TagSerializer(serializers.ModelSerializer):
         )
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(TimedSerializerMixin,
+                           serializers.ModelSerializer):
     '''Сериализатор для ингридиентов'''
 
     class Meta:
@@ -118,10 +140,10 @@ class GetIngridientsForRecipeSerializer(serializers.ModelSerializer):
 
 
 class PostIngridientsForRecipeSerializer(serializers.ModelSerializer):
-    '''Сериализатор для игридиентов рецепта для get запроса рецептов'''
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all()
-    )
+    '''Сериализатор для игридиентов рецепта для get запроса рецептов.
+    Ингредиенты по id ищет RecipePostSerializer одним запросом.
+    '''
+    id = serializers.IntegerField()
 
     class Meta:
         model = IngredientForRecipe
@@ -131,18 +153,24 @@ class PostIngridientsForRecipeSerializer(serializers.ModelSerializer):
         )
 
 
-class RecipeGetSerializer(serializers.ModelSerializer):
+class RecipeGetSerializer(TimedSerializerMixin,
+                          serializers.ModelSerializer):
     '''Сериализатор для рецептов для get запросов'''
     is_favorited = serializers.BooleanField(read_only=True)
     is_in_shopping_cart = serializers.BooleanField(read_only=True)
     author = UserSerializer(read_only=True)
     image = Base64ImageField()
+    images = serializers.SerializerMethodField(read_only=True)
     ingredients = GetIngridientsForRecipeSerializer(
         many=True,
         source='recipe'
     )
     tags = TagSerializer(many=True)
 
+    def get_images(self, obj):
+        '''Ссылки на уменьшенные копии картинки'''
+        return variant_urls(obj, self.context.get('request'))
+
     class Meta:
         model = Recipe
         fields = (
@@ -154,8 +182,10 @@ class RecipeGetSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'images',
             'text',
             'cooking_time',
+            'favorites_count',
             "pub_date"
         )
 
@@ -171,6 +201,21 @@ class RecipePostSerializer(serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     ingredients = PostIngridientsForRecipeSerializer(many=True)
 
+    def validate_ingredients(self, ingredients):
+        '''Заменяем id на ингредиенты, все одним запросом'''
+        found = Ingredient.objects.in_bulk(
+            [ingredient['id'] for ingredient in ingredients]
+        )
+        for ingredient in ingredients:
+            if ingredient['id'] not in found:
+                raise serializers.ValidationError(
+                    f'Ингредиента с id {ingredient["id"]} не существует'
+                )
+        return [
+            {**ingredient, 'id': found[ingredient['id']]}
+            for ingredient in ingredients
+        ]
+
     def _create_ingredients(self, ingredients, recipe):
         create_ingredient = [
             IngredientForRecipe(
@@ -194,28 +239,100 @@ class RecipePostSerializer(serializers.ModelSerializer):
         recipe = Recipe.objects.create(**validated_data)
         recipe.tags.set(tags)
         self._create_ingredients(ingredient, recipe)
+        transaction.on_commit(lambda: schedule_variants(recipe.pk))
         return recipe
 
+    def _update_tags(self, recipe, tags):
+        '''Убираем и добавляем только изменившиеся теги'''
+        current = set(recipe.tags.values_list('id', flat=True))
+        submitted = {tag.id for tag in tags}
+        if current - submitted:
+            recipe.tags.remove(*(current - submitted))
+        if submitted - current:
+            recipe.tags.add(*(submitted - current))
+
+    def _update_ingredients(self, recipe, ingredients):
+        '''Сравниваем ингредиенты рецепта с присланными и меняем
+        только отличающиеся строки. Возвращаем id измененных ингредиентов.
+        '''
+        rows = IngredientForRecipe.objects.filter(
+            recipe=recipe
+        ).values_list('id', 'ingredient_id', 'amount')
+        current = {
+            ingredient_id: (pk, amount)
+            for pk, ingredient_id, amount in rows
+        }
+        submitted = {
+            ingredient['id'].id: ingredient['amount']
+            for ingredient in ingredients
+        }
+        removed = current.keys() - submitted.keys()
+        changed_ids = {
+            ingredient_id for ingredient_id, amount in submitted.items()
+            if ingredient_id in current
+            and current[ingredient_id][1] != amount
+        }
+        changed = [
+            IngredientForRecipe(
+                id=current[ingredient_id][0],
+                amount=submitted[ingredient_id]
+            )
+            for ingredient_id in changed_ids
+        ]
+        added = [
+            IngredientForRecipe(
+                recipe=recipe,
+                ingredient_id=ingredient_id,
+                amount=amount
+            )
+            for ingredient_id, amount in submitted.items()
+            if ingredient_id not in current
+        ]
+        if removed:
+            IngredientForRecipe.objects.filter(
+                recipe=recipe,
+                ingredient_id__in=removed
+            ).delete()
+        if changed:
+            IngredientForRecipe.objects.bulk_update(changed, ['amount'])
+        if added:
+            IngredientForRecipe.objects.bulk_create(added)
+        return removed | changed_ids | submitted.keys() - current.keys()
+
     @transaction.atomic
     def update(self, instance, validated_data):
-        instance.image = validated_data.get('image', instance.image)
-        instance.name = validated_data.get('name', instance.name)
-        instance.text = validated_data.get('text', instance.text)
-        instance.cooking_time = validated_data.get(
-            'cooking_time', instance.cooking_time
-        )
-        instance.tags.clear()
-        tags = self.initial_data.get('tags')
-        instance.tags.set(tags)
-        IngredientForRecipe.objects.filter(recipe=instance).all().delete()
-        self._create_ingredients(
-            validated_data.get('ingredients'),
-            instance
-        )
-        instance.save()
+        '''Записываем только то, что отличается от сохраненного рецепта'''
+        update_fields = [
+            field for field in ('name', 'text', 'cooking_time')
+            if field in validated_data
+            and getattr(instance, field) != validated_data[field]
+        ]
+        for field in update_fields:
+            setattr(instance, field, validated_data[field])
+        if 'image' in validated_data:
+            delete_variant_files((instance.image_variants or {}).values())
+            instance.image = validated_data['image']
+            instance.image_variants = {}
+            update_fields += ['image', 'image_variants']
+            transaction.on_commit(lambda: schedule_variants(instance.pk))
+        if update_fields:
+            instance.save(update_fields=update_fields)
+        if 'tags' in validated_data:
+            self._update_tags(instance, validated_data['tags'])
+        if 'ingredients' in validated_data:
+            with bulk_changes(IngredientForRecipe):
+                ingredient_ids = self._update_ingredients(
+                    instance, validated_data['ingredients']
+                )
+            if ingredient_ids:
+                # сигналы строк выключены, сбрасываем кэш
+                # и пересчитываем корзины один раз
+                invalidate(recipe_ids=[instance.pk])
+                ingredients_changed_in_recipe(instance.pk, ingredient_ids)
         return instance
 
     def to_representation(self, obj):
+        obj = Recipe.objects.for_read().get(pk=obj.pk)
         return RecipeGetSerializer(obj, context=self.context).data
 
     class Meta:
@@ -233,27 +350,57 @@ class RecipePostSerializer(serializers.ModelSerializer):
         )
 
 
+def get_recipes_by_author(author_ids, recipes_limit=None):
+    '''Рецепты авторов одним запросом: {id автора: [рецепты]}.
+    Первые recipes_limit рецептов каждого автора отбираем в БД
+    оконной функцией ROW_NUMBER.
+    '''
+    recipes = Recipe.objects.filter(
+        author_id__in=author_ids
+    ).only(
+        'id', 'name', 'image', 'image_variants', 'cooking_time', 'author_id'
+    )
+    if recipes_limit:
+        ranked = recipes.annotate(
+            recipe_rank=Window(
+                expression=RowNumber(),
+                partition_by=[F('author_id')],
+                order_by=[F('pub_date').desc(), F('id').desc()]
+            )
+        ).order_by()
+        # Django 3.2 не умеет фильтровать по оконным функциям,
+        # поэтому фильтруем во внешнем запросе
+        sql, params = ranked.query.sql_with_params()
+        recipes = Recipe.objects.raw(
+            f'SELECT * FROM ({sql}) ranked '
+            'WHERE recipe_rank <= %s ORDER BY recipe_rank',
+            (*params, int(recipes_limit))
+        )
+    recipes_by_author = {author_id: [] for author_id in author_ids}
+    for recipe in recipes:
+        recipes_by_author[recipe.author_id].append(recipe)
+    return recipes_by_author
+
+
 class SubscriberSerializer(UserSerializer):
-    '''Сериализатор подписок для вывода информции'''
-    recipes_count = serializers.SerializerMethodField(read_only=True)
+    '''Сериализатор подписок для вывода информции.
+    Для страницы подписок рецепты всех авторов передаются
+    в context['recipes'].
+    '''
+    recipes_count = serializers.IntegerField(read_only=True)
     recipes = serializers.SerializerMethodField(read_only=True)
 
-    def get_recipes_count(self, obj):
-        '''Подсчитываем количество рецептов'''
-        return obj.recipes.count()
-
     def get_recipes(self, obj):
         '''Возвращаем рецепты автора'''
         request = self.context.get('request')
-        recipes_limit = request.query_params.get('recipes_limit')
-        if recipes_limit:
-            return SubscriberRecipeSerializer(
-                Recipe.objects.filter(author=obj)[:int(recipes_limit)],
-                many=True,
-                context={'request': request}
-            ).data
+        recipes = self.context.get('recipes')
+        if recipes is None:
+            recipes = get_recipes_by_author(
+                [obj.id],
+                request.query_params.get('recipes_limit')
+            )
         return SubscriberRecipeSerializer(
-            Recipe.objects.filter(author=obj),
+            recipes[obj.id],
             many=True,
             context={'request': request}
         ).data
@@ -282,14 +429,24 @@ class SubscriberListSerializer(serializers.ModelSerializer):
             "subscriber",
             "author"
         )
+        read_only_fields = (
+            "subscriber",
+            "author"
+        )
 
 
-class SubscriberRecipeSerializer(serializers.ModelSerializer):
+class SubscriberRecipeSerializer(TimedSerializerMixin,
+                                 serializers.ModelSerializer):
     '''Сериализатор который показывает рецепты автора
     на которого подписан юзер.
     Предназначен для сериализатора SubscriberSerializer
     '''
     image = Base64ImageField()
+    images = serializers.SerializerMethodField(read_only=True)
+
+    def get_images(self, obj):
+        '''Ссылки на уменьшенные копии картинки'''
+        return variant_urls(obj, self.context.get('request'))
 
     class Meta:
         model = Recipe
@@ -297,17 +454,15 @@ class SubscriberRecipeSerializer(serializers.ModelSerializer):
             'id',
             'name',
             'image',
+            'images',
             'cooking_time'
         )
 
 
-class ShoppintCartSerializer(serializers.ModelSerializer):
-    '''Сериализатор для корзины'''
-
-    class Meta:
-        model = Cart
-        fields = (
-            'id',
-            "recipe",
-            "user"
-        )
+class RecipeIdsSerializer(serializers.Serializer):
+    '''Список id рецептов для массового добавления и удаления'''
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_BULK_RECIPES
+    )
@@ -0,0 +1,86 @@
+import csv
+import tempfile
+
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+TITLE = 'Продукты которые нужно купить:'
+SIGNATURE = 'Проект создан Filengun'
+PDF_FONT = 'ShoppingCartFont'
+PDF_FONT_SIZE = 12
+PDF_MARGIN = 50
+# Сколько байт PDF держим в памяти, дальше файл уходит на диск
+PDF_MAX_MEMORY = 1024 * 1024
+
+
+def txt_lines(ingredients):
+    '''Построчно отдаем список покупок в txt'''
+    yield f'{TITLE}\n\n'
+    for ingredient in ingredients:
+        yield '- {}({}) - {}\n'.format(
+            ingredient['name'],
+            ingredient['measurement_unit'],
+            ingredient['amount']
+        )
+    yield f'\n\n\n\n{SIGNATURE}'
+
+
+class Echo:
+    '''Файл для csv.writer, который возвращает строку вместо записи'''
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(ingredients):
+    '''Построчно отдаем список покупок в csv'''
+    writer = csv.writer(Echo())
+    yield writer.writerow(('Ингредиент', 'Единица измерения', 'Количество'))
+    for ingredient in ingredients:
+        yield writer.writerow((
+            ingredient['name'],
+            ingredient['measurement_unit'],
+            ingredient['amount']
+        ))
+
+
+def pdf_file(ingredients):
+    '''Собираем список покупок в PDF.
+    Файл временный: пока он небольшой, он лежит в памяти,
+    большой файл сбрасывается на диск.
+    '''
+    if PDF_FONT not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(
+            TTFont(PDF_FONT, settings.SHOPPING_CART_PDF_FONT)
+        )
+    file = tempfile.SpooledTemporaryFile(max_size=PDF_MAX_MEMORY)
+    pdf = canvas.Canvas(file, pagesize=A4)
+    _, height = A4
+    line_height = PDF_FONT_SIZE * 1.5
+    y = height - PDF_MARGIN
+
+    def draw(text):
+        nonlocal y
+        if y < PDF_MARGIN:
+            pdf.showPage()
+            y = height - PDF_MARGIN
+        pdf.setFont(PDF_FONT, PDF_FONT_SIZE)
+        pdf.drawString(PDF_MARGIN, y, text)
+        y -= line_height
+
+    draw(TITLE)
+    y -= line_height
+    for ingredient in ingredients:
+        draw('- {}({}) - {}'.format(
+            ingredient['name'],
+            ingredient['measurement_unit'],
+            ingredient['amount']
+        ))
+    y -= line_height
+    draw(SIGNATURE)
+    pdf.save()
+    file.seek(0)
+    return file
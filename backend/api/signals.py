@@ -0,0 +1,112 @@
+from django.contrib.auth.signals import user_logged_out
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+from recipes.models import Ingredient, IngredientForRecipe, Recipe, Tag
+from recipes.signals import muted_senders
+from rest_framework.authtoken.models import Token
+from users.models import User
+
+from .authentication import token_cache
+from .catalog_cache import ingredient_catalog, tag_catalog
+from .recipe_cache import invalidate, recipe_scopes
+
+# Поля пользователя, которые видны в рецептах
+AUTHOR_FIELDS = {'email', 'username', 'first_name', 'last_name'}
+# Поля, после изменения которых кэш токенов пользователя устарел
+AUTH_FIELDS = {'password', 'is_active'}
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def ingredient_changed(**kwargs):
+    '''Ингредиент изменился - сбрасываем кэш и индекс автодополнения'''
+    ingredient_catalog.invalidate()
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def tag_changed(**kwargs):
+    '''Тег изменился - сбрасываем кэш тегов и всех рецептов'''
+    tag_catalog.invalidate()
+    invalidate(scopes=['global'])
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(instance, **kwargs):
+    '''Сбрасываем кэш страниц, где есть рецепт'''
+    invalidate(recipe_ids=[instance.pk])
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleted(instance, **kwargs):
+    '''После удаления рецепта его теги уже не найти, собираем их сейчас'''
+    invalidate(scopes=recipe_scopes([instance.pk]))
+
+
+@receiver((post_save, post_delete), sender=IngredientForRecipe)
+def recipe_ingredient_changed(sender, instance, **kwargs):
+    '''Поменялись ингредиенты рецепта'''
+    if sender not in muted_senders.get():
+        invalidate(recipe_ids=[instance.recipe_id])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(instance, action, reverse, pk_set, **kwargs):
+    '''Поменялись теги рецепта: сбрасываем и старые, и новые теги'''
+    if action == 'pre_clear':
+        recipe_ids = (
+            instance.recipes.values_list('id', flat=True) if reverse
+            else [instance.pk]
+        )
+        invalidate(scopes=recipe_scopes(list(recipe_ids)))
+    elif action in ('post_add', 'post_remove'):
+        if reverse:
+            invalidate(
+                scopes=[f'tag:{instance.slug}'],
+                recipe_ids=pk_set
+            )
+        elif action == 'post_add':
+            # новые теги рецепта найдутся после коммита
+            invalidate(recipe_ids=[instance.pk])
+        else:
+            invalidate(
+                scopes=[
+                    f'tag:{slug}' for slug in Tag.objects.filter(
+                        pk__in=pk_set
+                    ).values_list('slug', flat=True)
+                ],
+                recipe_ids=[instance.pk]
+            )
+
+
+@receiver(post_save, sender=User)
+def author_changed(instance, created, update_fields, **kwargs):
+    '''Автор поменял профиль - сбрасываем его рецепты'''
+    if created or (update_fields and not AUTHOR_FIELDS & set(update_fields)):
+        return
+    invalidate(
+        scopes=[f'author:{instance.pk}'],
+        recipe_ids=instance.recipes.values_list('id', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(instance, **kwargs):
+    '''Выход, удаление пользователя или токена в админке'''
+    token_cache.invalidate([instance.key])
+
+
+@receiver(user_logged_out)
+def user_logged_out_handler(request, **kwargs):
+    '''Выход через djoser token_destroy'''
+    if isinstance(getattr(request, 'auth', None), Token):
+        token_cache.invalidate([request.auth.key])
+
+
+@receiver(post_save, sender=User)
+def user_auth_changed(instance, created, update_fields, **kwargs):
+    '''Сменился пароль или пользователя деактивировали'''
+    if created or (update_fields and not AUTH_FIELDS & set(update_fields)):
+        return
+    token_cache.invalidate(
+        Token.objects.filter(user=instance).values_list('key', flat=True)
+    )
@@ -1,33 +1,114 @@
 from django.contrib.auth import get_user_model
-from django.db.models import Exists, OuterRef, Sum
-from django.http import HttpResponse
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Value
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
-from recipes.models import (Bookmark, Cart, Ingredient, IngredientForRecipe,
-                            Recipe, Tag)
+from prometheus_client import CONTENT_TYPE_LATEST
+from recipes.cart_totals import merge_totals, recipes_changed_in_cart
+from recipes.counters import refresh_counters
+from recipes.models import Bookmark, Cart, CartTotal, Ingredient, Recipe, Tag
+from recipes.signals import bulk_changes
 from rest_framework import permissions, status, viewsets
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from users.models import Subscription
 
+from .catalog_cache import ingredient_catalog, tag_catalog
+from .db import (mark_write, recently_wrote, reset_replica, use_primary,
+                 use_replica)
 from .filters import IngredientsFilter, RecipesFilter
-from .pagination import UserPagination
+from .ingredient_index import ingredient_index
+from .metrics import render_metrics
+from .pagination import (RecipeCursorPagination, SubscriptionCursorPagination,
+                         UserPagination)
 from .permissions import IsAuthorOrReadOnly
+from .recipe_cache import recipe_cache
+from .renderers import (CSVRenderer, FormatNegotiation, PDFRenderer,
+                        PlainTextRenderer)
 from .serializers import (IngredientSerializer, RecipeGetSerializer,
-                          RecipePostSerializer, ShoppintCartSerializer,
+                          RecipeIdsSerializer, RecipePostSerializer,
                           SubscriberListSerializer, SubscriberRecipeSerializer,
-                          SubscriberSerializer, TagSerializer, UserSerializer)
+                          SubscriberSerializer, TagSerializer, UserSerializer,
+                          get_recipes_by_author)
+from .shopping_cart import csv_lines, pdf_file, txt_lines
 
 User = get_user_model()
 
+# Поля рецепта для короткого ответа SubscriberRecipeSerializer
+SHORT_RECIPE_FIELDS = ('id', 'name', 'image', 'image_variants', 'cooking_time')
 
-class UserViewSet(UserViewSet):
+
+class CursorPaginationMixin:
+    '''Пагинация по курсору включается параметром cursor,
+    без него остаются номера страниц
+    '''
+    cursor_pagination_class = None
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator') and (
+            self.cursor_pagination_class is not None
+            and 'cursor' in self.request.query_params
+        ):
+            self._paginator = self.cursor_pagination_class()
+        return super().paginator
+
+
+class ReplicaReadMixin:
+    '''Безопасные запросы действий replica_actions читают с реплики,
+    если пользователь недавно ничего не менял. Токен проверяется
+    до переключения, то есть всегда в основной БД.
+    '''
+    replica_actions = ('list', 'retrieve')
+
+    def initial(self, request, *args, **kwargs):
+        self.replica_token = None
+        super().initial(request, *args, **kwargs)
+        if (
+            request.method in permissions.SAFE_METHODS
+            and self.action in self.replica_actions
+            and not recently_wrote(request.user)
+        ):
+            self.replica_token = use_replica()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        reset_replica(getattr(self, 'replica_token', None))
+        self.replica_token = None
+        if (
+            request.method not in permissions.SAFE_METHODS
+            and response.status_code < status.HTTP_400_BAD_REQUEST
+            and request.user.is_authenticated
+        ):
+            mark_write(request.user)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class UserViewSet(ReplicaReadMixin, CursorPaginationMixin, UserViewSet):
     '''Вьюсет для юзера'''
     queryset = User.objects.all()
     serializer_class = UserSerializer
     pagination_class = UserPagination
+    cursor_pagination_class = SubscriptionCursorPagination
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+    replica_actions = ('list', 'retrieve', 'subscriptions')
+
+    def get_queryset(self):
+        '''Аннотируем is_subscribed одним подзапросом'''
+        queryset = super().get_queryset()
+        user = self.request.user
+        if user.is_authenticated:
+            return queryset.annotate(
+                is_subscribed=Exists(
+                    Subscription.objects.filter(
+                        subscriber=user,
+                        author=OuterRef("pk")
+                    )
+                )
+            )
+        return queryset
 
     @action(
         detail=False,
@@ -36,12 +117,18 @@ class UserViewSet(UserViewSet):
     )
     def subscriptions(self, request):
         '''Авторы на которых подписан Юзер'''
-        subscribers = User.objects.filter(author__subscriber=request.user)
+        subscribers = User.objects.filter(
+            author__subscriber=request.user
+        ).annotate(is_subscribed=Value(True)).order_by('id')
         page = self.paginate_queryset(subscribers)
+        recipes = get_recipes_by_author(
+            [author.id for author in page],
+            request.query_params.get('recipes_limit')
+        )
         serializer = SubscriberSerializer(
             page,
             many=True,
-            context={'request': request}
+            context={'request': request, 'recipes': recipes}
         )
         return self.get_paginated_response(serializer.data)
 
@@ -55,16 +142,13 @@ class UserViewSet(UserViewSet):
         author = get_object_or_404(User, id=id)
         subscribed = request.user
         if request.method == 'POST':
-            data = {
-                'subscriber': subscribed.id,
-                'author': author.id
-            }
+            # пользователи уже загружены, не ищем их по id еще раз
             serializer = SubscriberListSerializer(
-                data=data,
+                data={},
                 context={'request': request}
             )
             serializer.is_valid(raise_exception=True)
-            serializer.save()
+            serializer.save(subscriber=subscribed, author=author)
             information_output_serializer = SubscriberSerializer(
                 author,
                 context={'request': request}
@@ -84,7 +168,32 @@ class UserViewSet(UserViewSet):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class IngredientViewSet(viewsets.ModelViewSet):
+class CatalogCacheMixin:
+    '''Отдаем список справочника из кэша готовым JSON'''
+    catalog = None
+
+    def list(self, request, *args, **kwargs):
+        renderer = request.accepted_renderer
+        if request.query_params or renderer.format != "json":
+            return super().list(request, *args, **kwargs)
+
+        def build():
+            with use_primary():
+                return renderer.render(
+                    self.get_serializer(
+                        self.filter_queryset(self.get_queryset()),
+                        many=True
+                    ).data
+                )
+
+        content, hit = self.catalog.get_or_set("list", build)
+        response = HttpResponse(content, content_type="application/json")
+        response["X-Cache"] = "HIT" if hit else "MISS"
+        return response
+
+
+class IngredientViewSet(ReplicaReadMixin, CatalogCacheMixin,
+                        viewsets.ModelViewSet):
     '''Вьюсет для ингридиентов'''
     queryset = Ingredient.objects.all()
     pagination_class = None
@@ -92,20 +201,31 @@ class IngredientViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend]
     filterset_class = IngredientsFilter
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+    catalog = ingredient_catalog
 
+    def list(self, request, *args, **kwargs):
+        '''Поиск по началу названия идет по индексу в памяти без БД'''
+        name = request.query_params.get('name')
+        if name:
+            return Response(ingredient_index.search(name))
+        return super().list(request, *args, **kwargs)
 
-class TagViewSet(viewsets.ModelViewSet):
+
+class TagViewSet(ReplicaReadMixin, CatalogCacheMixin, viewsets.ModelViewSet):
     '''Вьюсет для тегов'''
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+    catalog = tag_catalog
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ReplicaReadMixin, CursorPaginationMixin,
+                    viewsets.ModelViewSet):
     '''Вьюсет для рецептов'''
     queryset = Recipe.objects.all()
     permission_classes = (IsAuthorOrReadOnly,)
+    cursor_pagination_class = RecipeCursorPagination
     filter_backends = (DjangoFilterBackend, )
     filterset_class = RecipesFilter
     serializer_class = RecipeGetSerializer
@@ -118,12 +238,7 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         '''Метод возвращает набор необходимых данных'''
-        queryset = Recipe.objects.select_related(
-            "author"
-        ).prefetch_related(
-            "ingredients",
-            "tags"
-        )
+        queryset = Recipe.objects.for_read()
         user = self.request.user
         if user.is_authenticated:
             return queryset.annotate(
@@ -142,6 +257,55 @@ class RecipeViewSet(viewsets.ModelViewSet):
             )
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        '''Список рецептов, анонимам отдаем из кэша'''
+        if not self.can_use_cache(request):
+            return super().list(request, *args, **kwargs)
+        params = recipe_cache.list_params(request)
+        return self.cached_response(
+            request,
+            "list",
+            recipe_cache.list_scopes(params),
+            params.items(),
+            lambda: super(RecipeViewSet, self).list(request, *args, **kwargs)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        '''Страница рецепта, анонимам отдаем из кэша'''
+        if not self.can_use_cache(request):
+            return super().retrieve(request, *args, **kwargs)
+        return self.cached_response(
+            request,
+            "detail",
+            [f"recipe:{kwargs['pk']}"],
+            (),
+            lambda: super(RecipeViewSet, self).retrieve(
+                request, *args, **kwargs
+            )
+        )
+
+    def can_use_cache(self, request):
+        '''Ответы для анонимов не зависят от пользователя'''
+        return (
+            request.user.is_anonymous
+            and request.accepted_renderer.format == "json"
+        )
+
+    def cached_response(self, request, kind, scopes, params, get_response):
+        key = recipe_cache.get_key(request, kind, scopes, params)
+        content = recipe_cache.get(key)
+        hit = content is not None
+        if not hit:
+            with use_primary():
+                response = get_response()
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            content = request.accepted_renderer.render(response.data)
+            recipe_cache.set(key, kind, content)
+        response = HttpResponse(content, content_type="application/json")
+        response["X-Cache"] = "HIT" if hit else "MISS"
+        return response
+
     def perform_create(self, serializer):
         """"Передает в поле author данные о пользователе"""
         serializer.save(author=self.request.user)
@@ -150,6 +314,73 @@ class RecipeViewSet(viewsets.ModelViewSet):
         """Удаляет объект класса рецепт"""
         instance.delete()
 
+    @transaction.atomic
+    def add_recipes(self, model, recipe_ids):
+        '''Добавляем рецепты одним INSERT, уже добавленные пропускаем'''
+        model.objects.bulk_create(
+            [
+                model(user=self.request.user, recipe_id=recipe_id)
+                for recipe_id in recipe_ids
+            ],
+            ignore_conflicts=True
+        )
+        self.recipe_list_changed(model, recipe_ids)
+
+    @transaction.atomic
+    def remove_recipes(self, model, recipe_ids):
+        '''Удаляем рецепты без сигналов на каждую строку'''
+        with bulk_changes(model):
+            model.objects.filter(
+                user=self.request.user,
+                recipe_id__in=recipe_ids
+            ).delete()
+        self.recipe_list_changed(model, recipe_ids)
+
+    def recipe_list_changed(self, model, recipe_ids):
+        '''Сигналы строк не срабатывают, счетчики и итоги корзины
+        пересчитываем сами
+        '''
+        refresh_counters(model, recipe_ids)
+        if model is Cart:
+            recipes_changed_in_cart(self.request.user.id, recipe_ids)
+
+    def change_recipe_list(self, model, request, pk):
+        '''Добавление и удаление одного рецепта. Повторное добавление
+        и удаление отсутствующего рецепта не считаются ошибкой.
+        '''
+        if request.method == 'POST':
+            recipe = get_object_or_404(
+                Recipe.objects.only(*SHORT_RECIPE_FIELDS),
+                id=pk
+            )
+            self.add_recipes(model, [recipe.id])
+            serializer = SubscriberRecipeSerializer(recipe)
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        self.remove_recipes(model, [pk])
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def change_recipe_list_many(self, model, request):
+        '''Добавление и удаление списка рецептов: {"recipes": [id, ...]}'''
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = set(serializer.validated_data['recipes'])
+        if request.method == 'DELETE':
+            self.remove_recipes(model, recipe_ids)
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        recipes = list(
+            Recipe.objects.filter(id__in=recipe_ids).only(
+                *SHORT_RECIPE_FIELDS
+            )
+        )
+        missing = recipe_ids - {recipe.id for recipe in recipes}
+        if missing:
+            raise ValidationError(
+                {'recipes': [f'Рецепты не найдены: {sorted(missing)}']}
+            )
+        self.add_recipes(model, recipe_ids)
+        serializer = SubscriberRecipeSerializer(recipes, many=True)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
     @action(
         detail=True,
         methods=['POST', 'DELETE'],
@@ -157,25 +388,17 @@ class RecipeViewSet(viewsets.ModelViewSet):
     )
     def favorite(self, request, pk):
         '''Добавление и удаление в избранное'''
-        id = pk
-        recipe = get_object_or_404(Recipe, id=id)
-        if request.method == 'POST':
-            Bookmark.objects.create(
-                user=request.user,
-                recipe=recipe
-            )
-            serializer = SubscriberRecipeSerializer(recipe)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        if Bookmark.objects.filter(
-            user=request.user,
-            recipe__id=id
-        ).exists():
-            Bookmark.objects.filter(
-                user=request.user,
-                recipe__id=id
-            ).delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
-        return Response(status=status.HTTP_400_BAD_REQUEST)
+        return self.change_recipe_list(Bookmark, request, pk)
+
+    @action(
+        detail=False,
+        methods=['POST', 'DELETE'],
+        url_path='favorite',
+        permission_classes=(permissions.IsAuthenticated,)
+    )
+    def favorite_many(self, request):
+        '''Добавление и удаление в избранное нескольких рецептов'''
+        return self.change_recipe_list_many(Bookmark, request)
 
     @action(
         detail=True,
@@ -184,58 +407,63 @@ class RecipeViewSet(viewsets.ModelViewSet):
     )
     def shopping_cart(self, request, pk):
         '''Корзина'''
-        id = pk
-        recipe = get_object_or_404(Recipe, id=id)
-        if request.method == 'POST':
-            serializer = ShoppintCartSerializer(
-                data={
-                    'user': request.user.id,
-                    'recipe': recipe.id
-                }
-            )
-            serializer.is_valid(raise_exception=True)
-            serializer.save()
-            information_output_serializer = SubscriberRecipeSerializer(recipe)
-            return Response(
-                information_output_serializer.data,
-                status=status.HTTP_201_CREATED
-            )
-        if Cart.objects.filter(
-            user=request.user,
-            recipe__id=id
-        ).exists():
-            Cart.objects.filter(
-                user=request.user,
-                recipe__id=id
-            ).delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
-        return Response(status=status.HTTP_400_BAD_REQUEST)
+        return self.change_recipe_list(Cart, request, pk)
 
     @action(
-        methods=["GET"],
         detail=False,
+        methods=['POST', 'DELETE'],
+        url_path='shopping_cart',
         permission_classes=(permissions.IsAuthenticated,)
     )
+    def shopping_cart_many(self, request):
+        '''Добавление и удаление в корзину нескольких рецептов'''
+        return self.change_recipe_list_many(Cart, request)
+
+    @action(
+        methods=["GET"],
+        detail=False,
+        permission_classes=(permissions.IsAuthenticated,),
+        renderer_classes=(PlainTextRenderer, CSVRenderer, PDFRenderer),
+        content_negotiation_class=FormatNegotiation
+    )
     def download_shopping_cart(self, request):
-        '''Скачать информацию об рецептах в корзине'''
-        ingredients = IngredientForRecipe.objects.select_related(
-            "recipe", "ingredient"
-        )
-        ingredients = IngredientForRecipe.objects.filter(
-            recipe__cart__user=request.user
-        ).values(
-            "ingredient__name",
-            "ingredient__measurement_unit"
-        ).annotate(amount=Sum("amount"))
-        data_cart = "Продукты которые нужно купить:\n\n"
-        for ingredient in ingredients:
-            data_cart += "- {}({}) - {}\n".format(
-                ingredient['ingredient__name'],
-                ingredient['ingredient__measurement_unit'],
-                ingredient['amount']
+        '''Скачать информацию об рецептах в корзине.
+        Формат файла выбирается параметром format: txt, csv или pdf.
+        '''
+        # строки читаем здесь: под ASGI тело ответа перебирается
+        # в event loop, где запросы к БД запрещены
+        ingredients = list(merge_totals(
+            CartTotal.objects.filter(user=request.user).values(
+                'measurement_unit',
+                'amount',
+                name=F('ingredient__name')
+            ).order_by('name', 'measurement_unit')
+        ))
+        file_format = request.accepted_renderer.format
+        media_type = request.accepted_renderer.media_type
+        if file_format == "pdf":
+            response = FileResponse(
+                pdf_file(ingredients),
+                content_type=media_type
             )
-        data_cart += "\n\n\n\nПроект создан Filengun"
-        filename = "foodgram_shopping_cart.txt"
-        response = HttpResponse(data_cart, content_type="text/plain")
-        response["Content-Disposition"] = f"attachment; {filename}"
+        else:
+            lines = (
+                csv_lines(ingredients) if file_format == "csv"
+                else txt_lines(ingredients)
+            )
+            response = StreamingHttpResponse(
+                lines,
+                content_type=f"{media_type}; charset=utf-8"
+            )
+        filename = f"foodgram_shopping_cart.{file_format}"
+        response["Content-Disposition"] = (
+            f'attachment; filename="{filename}"'
+        )
         return response
+
+
+@api_view(['GET'])
+@permission_classes((permissions.IsAdminUser,))
+def metrics(request):
+    '''Метрики всех воркеров в формате Prometheus, только для админов'''
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE_LATEST)
@@ -2,11 +2,15 @@ import os
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-SECRET_KEY = '5l%lv(c=a7fq$l%nmzr*8x#9%*_b)9fmlxbq#*vsj4i#e1_4v6'
+SECRET_KEY = os.getenv(
+    'SECRET_KEY',
+    '5l%lv(c=a7fq$l%nmzr*8x#9%*_b)9fmlxbq#*vsj4i#e1_4v6'
+)
 
-DEBUG = True
+# В DEBUG Django хранит все SQL запросы процесса в connection.queries
+DEBUG = os.getenv('DEBUG', 'False').lower() == 'true'
 
-ALLOWED_HOSTS = ['*']
+ALLOWED_HOSTS = os.getenv('ALLOWED_HOSTS', '*').split(',')
 
 
 INSTALLED_APPS = [
@@ -27,6 +31,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
+    'api.nplusone.NPlusOneMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -62,6 +68,10 @@ WSGI_APPLICATION = 'foodgram.wsgi.application'
 #         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
 #     }
 # }
+# Пул соединений перед PostgreSQL, например pgbouncer в режиме transaction.
+# Тогда DB_HOST и DB_PORT указывают на пул.
+DB_POOLER = os.getenv("DB_POOLER", "")
+
 DATABASES = {
     "default": {
         "ENGINE": os.getenv("DB_ENGINE", "django.db.backends.postgresql"),
@@ -69,10 +79,44 @@ DATABASES = {
         "USER": os.getenv("POSTGRES_USER", "postgres"),
         "PASSWORD": os.getenv("POSTGRES_PASSWORD", "postgres"),
         "HOST": os.getenv("DB_HOST", "db"),
-        "PORT": os.getenv("DB_PORT", "5432")
+        "PORT": os.getenv("DB_PORT", "5432"),
+        # Сколько секунд держать соединение между запросами, 0 - закрывать
+        "CONN_MAX_AGE": int(os.getenv("DB_CONN_MAX_AGE", 60)),
+        # Пул в режиме transaction не поддерживает серверные курсоры
+        "DISABLE_SERVER_SIDE_CURSORS": bool(DB_POOLER),
     }
 }
 
+# Реплики только для чтения через запятую: адреса серверов PostgreSQL
+# или, для SQLite, файлы баз
+REPLICA_DATABASES = []
+REPLICA_KEY = "NAME" if "sqlite" in DATABASES["default"]["ENGINE"] else "HOST"
+for number, replica in enumerate(
+    filter(None, os.getenv("DB_REPLICAS", "").split(",")), 1
+):
+    alias = f"replica{number}"
+    DATABASES[alias] = {
+        **DATABASES["default"],
+        REPLICA_KEY: replica.strip(),
+        "TEST": {"MIRROR": "default"},
+    }
+    REPLICA_DATABASES.append(alias)
+
+DATABASE_ROUTERS = ["api.db.ReplicaRouter"]
+
+# Сколько секунд после изменения данных пользователь читает
+# из основной БД, пока реплики догоняют
+DB_REPLICA_STICKY_SECONDS = int(os.getenv("DB_REPLICA_STICKY_SECONDS", 5))
+
+# Проверять постоянное соединение в начале запроса и переоткрывать,
+# если БД или пул его закрыли
+DB_CONN_HEALTH_CHECKS = os.getenv(
+    "DB_CONN_HEALTH_CHECKS", "True"
+).lower() == "true"
+# Соединение, которое обслужило запрос за последние столько секунд,
+# не проверяем: под нагрузкой проверка не тратит время запросов
+DB_CONN_HEALTH_CHECK_IDLE = int(os.getenv("DB_CONN_HEALTH_CHECK_IDLE", 10))
+
 AUTH_USER_MODEL = 'users.User'
 
 
@@ -108,7 +152,7 @@ STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+MEDIA_ROOT = os.getenv('MEDIA_ROOT', os.path.join(BASE_DIR, 'media'))
 
 
 REST_FRAMEWORK = {
@@ -116,7 +160,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 6,
@@ -143,3 +187,75 @@ DJOSER = {
 }
 
 DIR_DATA_CSV = os.path.join(BASE_DIR, 'data')
+
+SHOPPING_CART_PDF_FONT = os.getenv(
+    'SHOPPING_CART_PDF_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
+# Для общего кэша между воркерами gunicorn, например:
+# CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache
+# CACHE_LOCATION=/var/tmp/foodgram_cache
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'foodgram'),
+    }
+}
+
+# LocMem свой в каждом процессе: версию справочника или рецептов,
+# смененную после изменения, видит только воркер, который его сделал.
+# Поэтому с таким кэшем ответы хранятся не дольше LOCAL_CACHE_MAX_TIMEOUT
+# секунд, для нескольких воркеров нужен общий CACHE_BACKEND.
+SHARED_CACHE = not CACHES['default']['BACKEND'].endswith(
+    ('LocMemCache', 'DummyCache')
+)
+LOCAL_CACHE_MAX_TIMEOUT = int(os.getenv('LOCAL_CACHE_MAX_TIMEOUT', 30))
+
+
+def cache_timeout(name, default):
+    '''Время жизни из переменной окружения name с учетом SHARED_CACHE'''
+    timeout = int(os.getenv(name, default))
+    if SHARED_CACHE:
+        return timeout
+    return min(timeout, LOCAL_CACHE_MAX_TIMEOUT)
+
+
+CATALOG_CACHE_TIMEOUT = cache_timeout('CATALOG_CACHE_TIMEOUT', 24 * 60 * 60)
+
+# Как часто перестраивать индекс автодополнения ингредиентов, секунд
+INGREDIENT_INDEX_TTL = cache_timeout('INGREDIENT_INDEX_TTL', 600)
+
+# Время жизни кэша рецептов для анонимных пользователей, секунд
+RECIPE_CACHE_LIST_TIMEOUT = cache_timeout('RECIPE_CACHE_LIST_TIMEOUT', 60)
+RECIPE_CACHE_DETAIL_TIMEOUT = cache_timeout(
+    'RECIPE_CACHE_DETAIL_TIMEOUT', 10 * 60
+)
+
+# Уменьшенные копии картинок рецептов делаются в фоновых потоках
+RECIPE_IMAGE_BACKGROUND = os.getenv(
+    'RECIPE_IMAGE_BACKGROUND', 'True'
+).lower() == 'true'
+RECIPE_IMAGE_WORKERS = int(os.getenv('RECIPE_IMAGE_WORKERS', 2))
+
+# Словарь PostgreSQL для полнотекстового поиска рецептов
+RECIPE_SEARCH_CONFIG = os.getenv('RECIPE_SEARCH_CONFIG', 'russian')
+
+# Кэш токенов в памяти процесса: сколько токенов держать и сколько
+# секунд. 0 - проверять токен в БД на каждом запросе. Версия токена
+# лежит в кэше, поэтому без общего кэша по умолчанию выключен (api.E002)
+AUTH_TOKEN_CACHE_SIZE = int(
+    os.getenv('AUTH_TOKEN_CACHE_SIZE', 10000 if SHARED_CACHE else 0)
+)
+AUTH_TOKEN_CACHE_TIMEOUT = int(os.getenv('AUTH_TOKEN_CACHE_TIMEOUT', 300))
+
+# Замеры запросов: заголовок Server-Timing и /api/_metrics
+REQUEST_METRICS = os.getenv('REQUEST_METRICS', 'True').lower() == 'true'
+
+# Поиск N+1: off, log - предупреждение в лог, raise - ошибка.
+# Запрос считается N+1, если повторился NPLUSONE_THRESHOLD раз.
+NPLUSONE_MODE = os.getenv('NPLUSONE_MODE', 'log' if DEBUG else 'off')
+NPLUSONE_THRESHOLD = int(os.getenv('NPLUSONE_THRESHOLD', 3))
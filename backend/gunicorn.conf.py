@@ -0,0 +1,60 @@
+import multiprocessing
+import os
+
+# Настройки gunicorn для продакшена, любую можно переопределить в .env
+
+bind = os.getenv('GUNICORN_BIND', '0:8000')
+
+# gthread: несколько потоков в воркере, пока один ждет БД, другие работают.
+# Соединений с БД будет до workers * threads, это должно влезать
+# в max_connections PostgreSQL или в размер пула.
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(
+    os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1)
+)
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+
+# Приложение загружается один раз в мастере до форка:
+# воркеры стартуют быстрее и делят память
+preload_app = os.getenv('GUNICORN_PRELOAD', 'True').lower() == 'true'
+
+# Перезапуск воркера после стольких запросов, чтобы утечки памяти
+# не копились. Разброс не дает всем воркерам уйти на перезапуск разом.
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+# пустое значение выключает журнал запросов
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-') or None
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+
+def pre_fork(server, worker):
+    '''Соединения с БД, открытые в мастере при загрузке приложения,
+    нельзя делить между процессами
+    '''
+    if server.cfg.preload_app:
+        from django.db import connections
+        connections.close_all()
+
+
+def on_starting(server):
+    '''Метрики прошлого запуска не должны попасть в новые'''
+    path = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if path:
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            if name.endswith('.db'):
+                os.remove(os.path.join(path, name))
+
+
+def child_exit(server, worker):
+    '''Счетчики завершившегося воркера остаются в сумме,
+    его файлы живых значений удаляются
+    '''
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -30,6 +30,8 @@ class RecipeAdmin(admin.ModelAdmin):
         'image',
         'cooking_time',
         'pub_date',
+        'favorites_count',
+        'carts_count',
     )
     list_filter = ('name',)
     empty_value_display = 'нет информации'
@@ -0,0 +1,96 @@
+from django.db import transaction
+from django.db.models import Sum
+from users.models import User
+
+from .models import CartTotal, IngredientForRecipe
+
+# Единица измерения: (базовая единица, множитель)
+UNITS = {
+    'кг': ('г', 1000),
+    'л': ('мл', 1000),
+}
+
+
+def normalize_unit(unit):
+    '''Переводим совместимые единицы в базовую'''
+    return UNITS.get(unit.strip().lower(), (unit, 1))
+
+
+def refresh_cart_totals(user_ids, ingredient_ids=None):
+    '''Пересчитываем итоги корзины пользователей user_ids.
+    Считаем только ингредиенты ingredient_ids (список или подзапрос),
+    None - все ингредиенты корзины.
+    '''
+    totals = CartTotal.objects.filter(user_id__in=user_ids)
+    rows = IngredientForRecipe.objects.filter(
+        recipe__cart__user_id__in=user_ids
+    )
+    if ingredient_ids is not None:
+        totals = totals.filter(ingredient_id__in=ingredient_ids)
+        rows = rows.filter(ingredient_id__in=ingredient_ids)
+    rows = rows.values_list(
+        'recipe__cart__user_id',
+        'ingredient_id',
+        'ingredient__measurement_unit'
+    ).annotate(amount=Sum('amount')).order_by()
+    with transaction.atomic(savepoint=False):
+        # одновременные пересчеты одного пользователя идут по очереди
+        list(
+            User.objects.select_for_update().filter(
+                pk__in=user_ids
+            ).values_list('pk', flat=True)
+        )
+        totals.delete()
+        new_totals = []
+        for user_id, ingredient_id, unit, amount in rows:
+            unit, factor = normalize_unit(unit)
+            new_totals.append(CartTotal(
+                user_id=user_id,
+                ingredient_id=ingredient_id,
+                measurement_unit=unit,
+                amount=amount * factor
+            ))
+        CartTotal.objects.bulk_create(new_totals)
+
+
+def recipes_changed_in_cart(user_id, recipe_ids):
+    '''В корзине пользователя появились или пропали рецепты'''
+    refresh_cart_totals(
+        [user_id],
+        IngredientForRecipe.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values('ingredient_id')
+    )
+
+
+def ingredients_changed_in_recipe(recipe_id, ingredient_ids):
+    '''У рецепта поменялись ингредиенты - пересчитываем их
+    у всех, у кого рецепт в корзине
+    '''
+    user_ids = list(
+        User.objects.filter(cart__recipe_id=recipe_id).values_list(
+            'pk', flat=True
+        )
+    )
+    if user_ids:
+        refresh_cart_totals(user_ids, ingredient_ids)
+
+
+def merge_totals(totals):
+    '''Один продукт может быть заведен несколько раз, например
+    "мука, г" и "мука, кг". После перевода в базовые единицы
+    соседние строки с одинаковым названием и единицей складываем.
+    '''
+    current = None
+    for total in totals:
+        if current and (
+            (current['name'], current['measurement_unit'])
+            == (total['name'], total['measurement_unit'])
+        ):
+            current['amount'] += total['amount']
+            continue
+        if current:
+            yield current
+        current = dict(total)
+    if current:
+        yield current
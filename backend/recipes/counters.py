@@ -0,0 +1,63 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from users.models import User
+
+from .models import Bookmark, Cart, Recipe
+
+# Счетчик: (модель, поле счетчика, модель связей, поле связи)
+COUNTERS = (
+    (Recipe, 'favorites_count', Bookmark, 'recipe'),
+    (Recipe, 'carts_count', Cart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+)
+
+
+def change_counter(model, pk, counter, delta):
+    '''Атомарно меняем счетчик, не уходя ниже нуля'''
+    queryset = model.objects.filter(pk=pk)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{counter}__gte': -delta})
+    queryset.update(**{counter: F(counter) + delta})
+
+
+def actual_count(related, field):
+    '''Подзапрос с настоящим количеством связанных строк'''
+    return Coalesce(
+        Subquery(
+            related.objects.filter(
+                **{field: OuterRef('pk')}
+            ).order_by().values(field).annotate(
+                total=Count('pk')
+            ).values('total')
+        ),
+        0
+    )
+
+
+def refresh_counters(related, pks):
+    '''Пересчитываем одним UPDATE счетчики, которые зависят от related.
+    Нужно после bulk-операций, которые не вызывают сигналы.
+    '''
+    for model, counter, counted, field in COUNTERS:
+        if counted is related:
+            model.objects.filter(pk__in=pks).update(
+                **{counter: actual_count(related, field)}
+            )
+
+
+def recount(dry_run=False):
+    '''Сверяем счетчики с таблицами и исправляем расхождения.
+    Возвращаем количество строк с неверным счетчиком.
+    '''
+    drift = {}
+    for model, counter, related, field in COUNTERS:
+        actual = actual_count(related, field)
+        stale = model.objects.annotate(actual=actual).exclude(
+            **{counter: F('actual')}
+        )
+        drift[f'{model.__name__}.{counter}'] = stale.count()
+        if not dry_run:
+            model.objects.filter(
+                pk__in=stale.values('pk')
+            ).update(**{counter: actual})
+    return drift
@@ -0,0 +1,125 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from PIL import Image, ImageOps
+
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+# Название копии: (наибольшая сторона, формат)
+VARIANTS = {
+    'card': (480, 'JPEG'),
+    'card_webp': (480, 'WEBP'),
+    'detail': (1200, 'JPEG'),
+    'detail_webp': (1200, 'WEBP'),
+}
+EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp'}
+QUALITY = 80
+
+executor = None
+
+
+def make_variants(recipe_id):
+    '''Делаем уменьшенные копии картинки рецепта и сохраняем их имена'''
+    recipe = Recipe.objects.only('id', 'image').get(pk=recipe_id)
+    with recipe.image.open('rb') as file:
+        original = ImageOps.exif_transpose(Image.open(file))
+        original.load()
+    original_name = recipe.image.name
+    stem = os.path.splitext(os.path.basename(original_name))[0]
+    variants = {}
+    for name, (size, image_format) in VARIANTS.items():
+        image = original.copy()
+        image.thumbnail((size, size), Image.LANCZOS)
+        if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        buffer = BytesIO()
+        image.save(buffer, image_format, quality=QUALITY, optimize=True)
+        variants[name] = default_storage.save(
+            f'recipes/variants/{stem}_{name}.{EXTENSIONS[image_format]}',
+            ContentFile(buffer.getvalue())
+        )
+    with transaction.atomic():
+        recipe = Recipe.objects.select_for_update().only(
+            'id', 'image', 'image_variants'
+        ).filter(pk=recipe_id).first()
+        # Пока копии делались, рецепт могли удалить или заменить картинку
+        if recipe is None or recipe.image.name != original_name:
+            delete_variant_files(variants.values())
+            return None
+        delete_variant_files(
+            set(recipe.image_variants.values()) - set(variants.values())
+        )
+        recipe.image_variants = variants
+        recipe.save(update_fields=['image_variants'])
+    return variants
+
+
+def delete_variant_files(names):
+    '''Удаляем файлы копий после коммита: при откате они еще нужны'''
+    names = list(names)
+
+    def delete():
+        for name in names:
+            default_storage.delete(name)
+
+    if names:
+        transaction.on_commit(delete)
+
+
+def run_in_background(recipe_id):
+    try:
+        make_variants(recipe_id)
+    except Recipe.DoesNotExist:
+        # рецепт удалили раньше, чем дошла очередь
+        pass
+    except Exception:
+        logger.exception(
+            'Не удалось обработать картинку рецепта %s', recipe_id
+        )
+    finally:
+        connections.close_all()
+
+
+def schedule_variants(recipe_id):
+    '''Обрабатываем картинку вне запроса, в пуле потоков.
+    Если RECIPE_IMAGE_BACKGROUND выключен - сразу.
+    '''
+    global executor
+    if not settings.RECIPE_IMAGE_BACKGROUND:
+        make_variants(recipe_id)
+        return
+    if executor is None:
+        executor = ThreadPoolExecutor(
+            max_workers=settings.RECIPE_IMAGE_WORKERS,
+            thread_name_prefix='recipe-images'
+        )
+    executor.submit(run_in_background, recipe_id)
+
+
+def variant_urls(recipe, request=None):
+    '''Ссылки на копии картинки, пока копий нет - на оригинал'''
+    if not recipe.image:
+        return None
+    original = recipe.image.url
+    variants = recipe.image_variants or {}
+    urls = {
+        name: (
+            default_storage.url(variants[name]) if name in variants
+            else original
+        )
+        for name in VARIANTS
+    }
+    if request is not None:
+        urls = {
+            name: request.build_absolute_uri(url)
+            for name, url in urls.items()
+        }
+    return urls
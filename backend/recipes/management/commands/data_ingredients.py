@@ -1,24 +1,180 @@
 import csv
+import io
+import json
+import os
 
-from django.core.management import BaseCommand
+from api.catalog_cache import ingredient_catalog
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
 from foodgram.settings import DIR_DATA_CSV
 from recipes.models import Ingredient
 
+JSON_CHUNK_SIZE = 64 * 1024
+
+
+def read_csv(file):
+    '''Построчно читаем ингредиенты из csv'''
+    reader = csv.DictReader(file, fieldnames=['name', 'measurement_unit'])
+    yield from reader
+
+
+def read_json(file):
+    '''Читаем массив ингредиентов из json кусками, не загружая файл целиком'''
+    decoder = json.JSONDecoder()
+    buffer = ''
+    opened = False
+    for chunk in iter(lambda: file.read(JSON_CHUNK_SIZE), ''):
+        buffer += chunk
+        while True:
+            buffer = buffer.lstrip().lstrip(',').lstrip()
+            if not buffer:
+                break
+            if not opened:
+                if buffer[0] != '[':
+                    raise CommandError('Ожидался массив ингредиентов')
+                opened = True
+                buffer = buffer[1:]
+                continue
+            if buffer[0] == ']':
+                return
+            try:
+                row, end = decoder.raw_decode(buffer)
+            except ValueError:
+                break
+            yield row
+            buffer = buffer[end:]
+    raise CommandError('Файл json оборван')
+
+
+def normalize(name, measurement_unit):
+    '''Ключ для сравнения ингредиентов из файла и из БД'''
+    return name.strip().lower(), measurement_unit.strip().lower()
+
+
+def reader_for(path):
+    '''Функция чтения по расширению файла'''
+    if path.endswith('.json'):
+        return read_json
+    if path.endswith('.csv'):
+        return read_csv
+    raise CommandError('Поддерживаются только файлы .csv и .json')
+
 
 class Command(BaseCommand):
-    '''Загружаем ингридиенты в БД'''
-    def handle(self, *args, **kwargs):
-        with open(
-            f'{DIR_DATA_CSV}/ingredients.csv',
-            newline="",
-            encoding='utf-8'
-        ) as file:
-            reader = csv.DictReader(file, fieldnames=[
-                'name', 'measurement_unit'
-            ])
-            for row in reader:
-                Ingredient.objects.update_or_create(**row)
+    '''Загружаем ингридиенты в БД.
+    Файл сравнивается с таблицей: новые ингредиенты добавляются,
+    у существующих исправляется написание, дубликаты пропускаются.
+    '''
+    help = 'Загружает ингредиенты из ingredients.csv или ingredients.json'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--file',
+            default=os.path.join(DIR_DATA_CSV, 'ingredients.csv'),
+            help='Путь к файлу .csv или .json'
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать, что будет изменено'
+        )
+
+    def handle(self, *args, **options):
+        path = options['file']
+        reader = reader_for(path)
+        self.batch_size = options['batch_size']
+        self.dry_run = options['dry_run']
+        self.created = self.updated = self.skipped = 0
+
+        with open(path, newline='', encoding='utf-8') as file:
+            with transaction.atomic():
+                self.upsert(reader(file))
+        # bulk-операции не вызывают сигналы, сбрасываем кэш сами
+        if not self.dry_run and (self.created or self.updated):
+            ingredient_catalog.invalidate()
 
+        message = (
+            f'Добавлено: {self.created}, обновлено: {self.updated}, '
+            f'без изменений: {self.skipped}'
+        )
+        if self.dry_run:
+            message = f'Пробный запуск, БД не изменена. {message}'
         self.stdout.write(self.style.SUCCESS(
-            'Загрузили ингредиенты'
+            f'Загрузили ингредиенты. {message}'
         ))
+
+    def upsert(self, rows):
+        '''Сравниваем строки файла с таблицей и пишем изменения пачками'''
+        existing = {
+            normalize(name, unit): (pk, name, unit)
+            for pk, name, unit in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            ).iterator()
+        }
+        seen = set()
+        to_create, to_update = [], []
+        for row in rows:
+            name = row['name'].strip()
+            unit = row['measurement_unit'].strip()
+            key = normalize(name, unit)
+            if key in seen:
+                self.skipped += 1
+                continue
+            seen.add(key)
+            if key not in existing:
+                to_create.append(Ingredient(name=name, measurement_unit=unit))
+            elif existing[key][1:] != (name, unit):
+                to_update.append(Ingredient(
+                    id=existing[key][0],
+                    name=name,
+                    measurement_unit=unit
+                ))
+            else:
+                self.skipped += 1
+            if len(to_create) >= self.batch_size:
+                self.create(to_create)
+                to_create = []
+            if len(to_update) >= self.batch_size:
+                self.update(to_update)
+                to_update = []
+        self.create(to_create)
+        self.update(to_update)
+
+    def create(self, ingredients):
+        '''Добавляем пачку ингредиентов, в PostgreSQL через COPY'''
+        if not ingredients:
+            return
+        if not self.dry_run:
+            if connection.vendor == 'postgresql':
+                self.copy(ingredients)
+            else:
+                Ingredient.objects.bulk_create(ingredients)
+        self.created += len(ingredients)
+        self.stdout.write(f'Добавлено ингредиентов: {self.created}')
+
+    def update(self, ingredients):
+        '''Обновляем пачку ингредиентов'''
+        if not ingredients:
+            return
+        if not self.dry_run:
+            Ingredient.objects.bulk_update(
+                ingredients,
+                ['name', 'measurement_unit']
+            )
+        self.updated += len(ingredients)
+        self.stdout.write(f'Обновлено ингредиентов: {self.updated}')
+
+    def copy(self, ingredients):
+        '''Загружаем ингредиенты командой COPY'''
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for ingredient in ingredients:
+            writer.writerow((ingredient.name, ingredient.measurement_unit))
+        buffer.seek(0)
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f'COPY {Ingredient._meta.db_table} (name, measurement_unit) '
+                'FROM STDIN WITH (FORMAT csv)',
+                buffer
+            )
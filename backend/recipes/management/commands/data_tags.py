@@ -1,3 +1,4 @@
+from api.catalog_cache import tag_catalog
 from django.core.management import BaseCommand
 from recipes.models import Tag
 
@@ -13,5 +14,6 @@ class Command(BaseCommand):
             {'name': 'Перекус', 'color': '#0ACF83', 'slug': 'snack'},
         ]
         Tag.objects.bulk_create(Tag(**tag) for tag in data)
+        tag_catalog.invalidate()
 
         self.stdout.write(self.style.SUCCESS('Загрузили теги'))
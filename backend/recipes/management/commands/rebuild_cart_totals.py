@@ -0,0 +1,26 @@
+from django.core.management import BaseCommand
+from django.db.models import Q
+from recipes.cart_totals import refresh_cart_totals
+from users.models import User
+
+
+class Command(BaseCommand):
+    '''Заново считаем итоги списков покупок'''
+    help = 'Пересчитывает итоги корзин всех пользователей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        # пустые корзины тоже, чтобы убрать устаревшие итоги
+        user_ids = list(
+            User.objects.filter(
+                Q(cart__isnull=False) | Q(cart_totals__isnull=False)
+            ).distinct().values_list('pk', flat=True)
+        )
+        batch_size = options['batch_size']
+        for start in range(0, len(user_ids), batch_size):
+            refresh_cart_totals(user_ids[start:start + batch_size])
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитали корзины пользователей: {len(user_ids)}'
+        ))
@@ -0,0 +1,11 @@
+from django.core.management import BaseCommand
+from recipes.search import rebuild_index
+
+
+class Command(BaseCommand):
+    '''Заново строим поисковый индекс рецептов'''
+    help = 'Пересчитывает поисковый индекс после массовой загрузки рецептов'
+
+    def handle(self, *args, **options):
+        rebuild_index()
+        self.stdout.write(self.style.SUCCESS('Поисковый индекс обновлен'))
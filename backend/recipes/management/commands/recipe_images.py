@@ -0,0 +1,31 @@
+from django.core.management import BaseCommand
+from recipes.images import make_variants
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    '''Делаем уменьшенные копии картинок, которые еще не обработаны'''
+    help = 'Создает уменьшенные копии картинок рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Пересоздать копии для всех рецептов'
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(image_variants={})
+        done = failed = 0
+        for recipe_id in recipes.values_list('id', flat=True).iterator():
+            try:
+                make_variants(recipe_id)
+                done += 1
+            except Exception as error:
+                failed += 1
+                self.stderr.write(f'Рецепт {recipe_id}: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано картинок: {done}, с ошибкой: {failed}'
+        ))
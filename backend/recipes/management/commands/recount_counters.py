@@ -0,0 +1,23 @@
+from django.core.management import BaseCommand
+from recipes.counters import recount
+
+
+class Command(BaseCommand):
+    '''Сверяем счетчики избранного, корзины и рецептов с таблицами'''
+    help = 'Пересчитывает favorites_count, carts_count и recipes_count'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать расхождения'
+        )
+
+    def handle(self, *args, **options):
+        drift = recount(dry_run=options['dry_run'])
+        for counter, stale in drift.items():
+            self.stdout.write(f'{counter}: расхождений {stale}')
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS('Проверили счетчики'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Пересчитали счетчики'))
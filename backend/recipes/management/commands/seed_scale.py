@@ -0,0 +1,311 @@
+import math
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import accumulate, islice
+
+from api.recipe_cache import invalidate
+from django.contrib.auth.hashers import make_password
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from recipes.models import (Bookmark, Cart, Ingredient, IngredientForRecipe,
+                            Recipe, Tag)
+from users.models import Subscription, User
+
+WORDS = (
+    'борщ', 'суп', 'салат', 'пирог', 'каша', 'котлеты', 'блины', 'плов',
+    'омлет', 'запеканка', 'рагу', 'паста', 'соус', 'торт', 'печенье',
+    'курица', 'говядина', 'рыба', 'грибы', 'овощи', 'сыр', 'картофель',
+    'домашний', 'быстрый', 'постный', 'острый', 'сладкий', 'летний',
+)
+
+# Показатель степени Ципфа: чем больше, тем сильнее популярные
+# авторы, рецепты и ингредиенты отрываются от остальных
+ZIPF_EXPONENT = 1.1
+
+
+def zipf_weights(size):
+    '''Накопленные веса для random.choices: первый в 2^s раз
+    популярнее второго и так далее
+    '''
+    return list(accumulate(
+        1 / (rank + 1) ** ZIPF_EXPONENT for rank in range(size)
+    ))
+
+
+def heavy_tail(rnd, mean, sigma=1.2):
+    '''Логнормальное количество со средним mean: у большинства
+    немного, у единиц очень много
+    '''
+    if mean <= 0:
+        return 0
+    return int(rnd.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma))
+
+
+def chunks(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+@contextmanager
+def explicit_pub_date():
+    '''Иначе bulk_create поставит всем рецептам текущее время'''
+    field = Recipe._meta.get_field('pub_date')
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    '''Заполняем БД данными размера продакшена для замеров.
+    Популярность авторов, рецептов и ингредиентов распределена по Ципфу,
+    количество подписок, избранного и корзин на пользователя - с тяжелым
+    хвостом. Строки вставляются пачками bulk_create, каждые chunk-size
+    строк - отдельная транзакция. При одинаковом --seed и одинаковой
+    исходной БД получаются одинаковые данные, только даты рецептов
+    отсчитываются от момента запуска.
+    '''
+    help = 'Генерирует пользователей, рецепты, избранное, корзины и подписки'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--recipes', type=int, default=50000)
+        parser.add_argument(
+            '--ingredients-per-recipe',
+            type=int,
+            nargs=2,
+            default=(3, 12),
+            metavar=('MIN', 'MAX')
+        )
+        parser.add_argument(
+            '--subscriptions',
+            type=float,
+            default=10,
+            help='Подписок на пользователя в среднем'
+        )
+        parser.add_argument(
+            '--bookmarks',
+            type=float,
+            default=20,
+            help='Рецептов в избранном на пользователя в среднем'
+        )
+        parser.add_argument(
+            '--carts',
+            type=float,
+            default=3,
+            help='Рецептов в корзине на пользователя в среднем'
+        )
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=365,
+            help='За сколько дней распределить даты рецептов'
+        )
+        parser.add_argument(
+            '--password',
+            help='Пароль всех пользователей, без него войти нельзя'
+        )
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=50000,
+            help='Сколько строк вставлять в одной транзакции'
+        )
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--skip-rebuild',
+            action='store_true',
+            help='Не пересчитывать счетчики, итоги корзин и поиск'
+        )
+
+    def handle(self, *args, **options):
+        tag_ids = list(Tag.objects.order_by('id').values_list('id', flat=True))
+        ingredient_ids = list(
+            Ingredient.objects.order_by('id').values_list('id', flat=True)
+        )
+        if not tag_ids or not ingredient_ids:
+            raise CommandError(
+                'Сначала загрузите теги и ингредиенты: '
+                'data_tags и data_ingredients'
+            )
+        self.rnd = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.chunk_size = options['chunk_size']
+        started = time.monotonic()
+
+        user_ids = self.create_users(options['users'], options['password'])
+        if not user_ids and options['recipes']:
+            raise CommandError('Рецептам нужны авторы, укажите --users')
+        # популярные - не первые по id, а случайные
+        authors = self.shuffled(user_ids)
+        recipe_ids = self.create_recipes(
+            options['recipes'], authors, options['days']
+        )
+        popular_recipes = self.shuffled(recipe_ids)
+        self.create_recipe_tags(recipe_ids, tag_ids)
+        self.create_recipe_ingredients(
+            recipe_ids,
+            self.shuffled(ingredient_ids),
+            options['ingredients_per_recipe']
+        )
+        self.create_subscriptions(user_ids, authors, options['subscriptions'])
+        self.create_user_recipes(
+            Bookmark, user_ids, popular_recipes, options['bookmarks']
+        )
+        self.create_user_recipes(
+            Cart, user_ids, popular_recipes, options['carts']
+        )
+
+        if not options['skip_rebuild']:
+            call_command('recount_counters', stdout=self.stdout)
+            call_command('rebuild_cart_totals', stdout=self.stdout)
+            call_command('rebuild_search_index', stdout=self.stdout)
+        # bulk-операции не вызывают сигналы, сбрасываем кэш сами
+        invalidate(scopes=['all', *(
+            f'tag:{slug}' for slug in Tag.objects.values_list(
+                'slug', flat=True
+            )
+        )])
+        self.stdout.write(self.style.SUCCESS(
+            f'Данные созданы за {time.monotonic() - started:.0f} с'
+        ))
+
+    def shuffled(self, ids):
+        ids = list(ids)
+        self.rnd.shuffle(ids)
+        return ids
+
+    def insert(self, model, rows):
+        '''Вставляем строки пачками, chunk_size строк в транзакции'''
+        total = 0
+        for chunk in chunks(rows, self.chunk_size):
+            with transaction.atomic():
+                model.objects.bulk_create(chunk, batch_size=self.batch_size)
+            total += len(chunk)
+            self.stdout.write(f'{model._meta.db_table}: {total}')
+        return total
+
+    def new_ids(self, model, after):
+        '''bulk_create в SQLite не возвращает id, читаем их из БД'''
+        return list(
+            model.objects.filter(id__gt=after).order_by('id').values_list(
+                'id', flat=True
+            )
+        )
+
+    def create_users(self, count, password):
+        last_id = User.objects.aggregate(last=Max('id'))['last'] or 0
+        password = make_password(password) if password else '!'
+        self.insert(User, (
+            User(
+                username=f'seed{last_id + i}',
+                email=f'seed{last_id + i}@example.com',
+                first_name='Имя',
+                last_name='Фамилия',
+                password=password
+            )
+            for i in range(1, count + 1)
+        ))
+        return self.new_ids(User, last_id)
+
+    def create_recipes(self, count, authors, days):
+        last_id = Recipe.objects.aggregate(last=Max('id'))['last'] or 0
+        weights = zipf_weights(len(authors))
+        start = timezone.now() - timedelta(days=days)
+        step = timedelta(days=days) / max(count, 1)
+        rnd = self.rnd
+
+        def recipes():
+            for i in range(count):
+                words = rnd.sample(WORDS, rnd.randint(2, 4))
+                yield Recipe(
+                    name=' '.join(words).capitalize(),
+                    author_id=rnd.choices(authors, cum_weights=weights)[0],
+                    text=' '.join(rnd.choices(WORDS, k=rnd.randint(10, 60))),
+                    image='recipes/seed.png',
+                    cooking_time=rnd.randint(5, 180),
+                    pub_date=start + step * i
+                )
+
+        with explicit_pub_date():
+            self.insert(Recipe, recipes())
+        return self.new_ids(Recipe, last_id)
+
+    def create_recipe_tags(self, recipe_ids, tag_ids):
+        through = Recipe.tags.through
+        self.insert(through, (
+            through(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id in recipe_ids
+            for tag_id in self.rnd.sample(
+                tag_ids, min(len(tag_ids), self.rnd.randint(1, 2))
+            )
+        ))
+
+    def create_recipe_ingredients(self, recipe_ids, ingredients, per_recipe):
+        weights = zipf_weights(len(ingredients))
+        low, high = per_recipe
+        rnd = self.rnd
+
+        def rows():
+            for recipe_id in recipe_ids:
+                # соль и лук встречаются чаще остальных
+                chosen = dict.fromkeys(rnd.choices(
+                    ingredients, cum_weights=weights, k=rnd.randint(low, high)
+                ))
+                for ingredient_id in chosen:
+                    yield IngredientForRecipe(
+                        recipe_id=recipe_id,
+                        ingredient_id=ingredient_id,
+                        amount=rnd.randint(1, 500)
+                    )
+
+        self.insert(IngredientForRecipe, rows())
+
+    def create_subscriptions(self, user_ids, authors, mean):
+        '''На популярных авторов подписаны многие'''
+        weights = zipf_weights(len(authors))
+        rnd = self.rnd
+
+        def rows():
+            for user_id in user_ids:
+                chosen = dict.fromkeys(rnd.choices(
+                    authors,
+                    cum_weights=weights,
+                    k=min(heavy_tail(rnd, mean), len(authors))
+                ))
+                chosen.pop(user_id, None)
+                for author_id in chosen:
+                    yield Subscription(
+                        subscriber_id=user_id, author_id=author_id
+                    )
+
+        self.insert(Subscription, rows())
+
+    def create_user_recipes(self, model, user_ids, recipes, mean):
+        '''Избранное и корзины: популярные рецепты добавляют чаще'''
+        if not recipes:
+            return
+        weights = zipf_weights(len(recipes))
+        rnd = self.rnd
+
+        def rows():
+            for user_id in user_ids:
+                chosen = dict.fromkeys(rnd.choices(
+                    recipes,
+                    cum_weights=weights,
+                    k=min(heavy_tail(rnd, mean), len(recipes))
+                ))
+                for recipe_id in chosen:
+                    yield model(user_id=user_id, recipe_id=recipe_id)
+
+        self.insert(model, rows())
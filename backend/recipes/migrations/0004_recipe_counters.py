@@ -0,0 +1,49 @@
+# Generated by Django 3.2.3 on 2026-10-18 20:22
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Bookmark = apps.get_model('recipes', 'Bookmark')
+    Cart = apps.get_model('recipes', 'Cart')
+    User = apps.get_model('users', 'User')
+    for model, counter, related, field in (
+        (Recipe, 'favorites_count', Bookmark, 'recipe'),
+        (Recipe, 'carts_count', Cart, 'recipe'),
+        (User, 'recipes_count', Recipe, 'author'),
+    ):
+        model.objects.update(**{counter: Coalesce(
+            Subquery(
+                related.objects.filter(
+                    **{field: OuterRef('pk')}
+                ).order_by().values(field).annotate(
+                    total=Count('pk')
+                ).values('total')
+            ),
+            0
+        )})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0003_recipe_image_variants'),
+        ('users', '0002_user_recipes_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавлений в корзину'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавлений в избранное'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
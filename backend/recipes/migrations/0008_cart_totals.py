@@ -0,0 +1,63 @@
+# Generated by Django 3.2.3 on 2026-10-18 20:33
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Sum
+
+UNITS = {
+    'кг': ('г', 1000),
+    'л': ('мл', 1000),
+}
+
+
+def fill_cart_totals(apps, schema_editor):
+    IngredientForRecipe = apps.get_model('recipes', 'IngredientForRecipe')
+    CartTotal = apps.get_model('recipes', 'CartTotal')
+    rows = IngredientForRecipe.objects.filter(
+        recipe__cart__isnull=False
+    ).values_list(
+        'recipe__cart__user_id',
+        'ingredient_id',
+        'ingredient__measurement_unit'
+    ).annotate(amount=Sum('amount')).order_by()
+    totals = []
+    for user_id, ingredient_id, unit, amount in rows.iterator():
+        unit, factor = UNITS.get(unit.strip().lower(), (unit, 1))
+        totals.append(CartTotal(
+            user_id=user_id,
+            ingredient_id=ingredient_id,
+            measurement_unit=unit,
+            amount=amount * factor
+        ))
+    CartTotal.objects.bulk_create(totals, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0007_recipe_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CartTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('measurement_unit', models.CharField(max_length=200, verbose_name='Единица измерения')),
+                ('amount', models.PositiveBigIntegerField(verbose_name='Количество')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cart_totals', to='recipes.ingredient', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cart_totals', to=settings.AUTH_USER_MODEL, verbose_name='Юзер')),
+            ],
+            options={
+                'verbose_name': 'Итог списка покупок',
+                'verbose_name_plural': 'Итоги списков покупок',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='carttotal',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_cart_total'),
+        ),
+        migrations.RunPython(fill_cart_totals, migrations.RunPython.noop),
+    ]
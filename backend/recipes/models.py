@@ -1,3 +1,4 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator, RegexValidator
 from django.db import models
 from users.models import User
@@ -62,6 +63,27 @@ class Ingredient(models.Model):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+    '''Набор данных рецептов'''
+
+    def for_read(self):
+        '''Рецепты со всеми связанными данными для RecipeGetSerializer.
+        Ингредиенты берем через модель IngredientForRecipe вместе
+        с самим ингредиентом.
+        '''
+        return self.select_related(
+            'author'
+        ).prefetch_related(
+            'tags',
+            models.Prefetch(
+                'recipe',
+                queryset=IngredientForRecipe.objects.select_related(
+                    'ingredient'
+                )
+            )
+        )
+
+
 class Recipe(models.Model):
     '''Модель рецепта'''
     name = models.CharField(
@@ -88,6 +110,26 @@ class Recipe(models.Model):
         upload_to='recipes/',
         verbose_name='Картинка'
     )
+    image_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name='Уменьшенные копии картинки'
+    )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Добавлений в избранное'
+    )
+    carts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Добавлений в корзину'
+    )
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name='Поисковый индекс'
+    )
     cooking_time = models.PositiveIntegerField(
         verbose_name='Затраченое время на приготовление',
         validators=[
@@ -109,10 +151,22 @@ class Recipe(models.Model):
         verbose_name='Ингридиенты'
     )
 
+    objects = RecipeQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
-        ordering = ("-pub_date", )
+        ordering = ("-pub_date", "-id")
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='recipe_pub_date_id_idx'
+            ),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='recipe_author_pub_date_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -216,3 +270,41 @@ class Cart(models.Model):
 
     def __str__(self):
         return (f"{self.user} добавил в корзину: {self.recipe}")
+
+
+class CartTotal(models.Model):
+    '''Готовый итог списка покупок пользователя по ингредиенту.
+    Количество хранится в базовой единице (г, мл).
+    '''
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='cart_totals',
+        verbose_name='Юзер'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='cart_totals',
+        verbose_name='Ингредиент'
+    )
+    measurement_unit = models.CharField(
+        max_length=200,
+        verbose_name='Единица измерения'
+    )
+    amount = models.PositiveBigIntegerField(
+        verbose_name='Количество'
+    )
+
+    class Meta:
+        verbose_name = 'Итог списка покупок'
+        verbose_name_plural = 'Итоги списков покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_cart_total'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.ingredient} ({self.measurement_unit}) - {self.amount}'
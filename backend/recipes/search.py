@@ -0,0 +1,110 @@
+import re
+
+from django.conf import settings
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connection
+from django.db.models import F
+from django.db.models.expressions import RawSQL
+
+from .models import Recipe
+
+# Таблица FTS5 для SQLite, rowid совпадает с id рецепта
+FTS_TABLE = 'recipes_recipe_fts'
+
+
+def search_vector():
+    '''Название важнее описания'''
+    config = settings.RECIPE_SEARCH_CONFIG
+    return (
+        SearchVector('name', weight='A', config=config)
+        + SearchVector('text', weight='B', config=config)
+    )
+
+
+def query_words(query):
+    '''Оставляем только слова, чтобы пользователь не мог
+    передать в полнотекстовый поиск служебный синтаксис
+    '''
+    return re.findall(r'\w+', query.lower())
+
+
+def search(queryset, query):
+    '''Рецепты, в названии или описании которых есть все слова запроса
+    (по началу слова), самые подходящие первыми
+    '''
+    words = query_words(query)
+    if not words:
+        return queryset
+    ordering = ('-search_rank', *Recipe._meta.ordering)
+    if connection.vendor == 'postgresql':
+        search_query = SearchQuery(
+            ' & '.join(f'{word}:*' for word in words),
+            search_type='raw',
+            config=settings.RECIPE_SEARCH_CONFIG
+        )
+        return queryset.filter(search_vector=search_query).annotate(
+            search_rank=SearchRank(F('search_vector'), search_query)
+        ).order_by(*ordering)
+    match = ' '.join(f'"{word}"*' for word in words)
+    table = Recipe._meta.db_table
+    return queryset.filter(
+        id__in=RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+            (match,)
+        )
+    ).annotate(
+        # rank в FTS5 - это bm25, чем меньше, тем лучше
+        search_rank=RawSQL(
+            f'SELECT -rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+            f'AND rowid = "{table}"."id"',
+            (match,)
+        )
+    ).order_by(*ordering)
+
+
+def update_index(recipe_ids):
+    '''Пересчитываем поисковый индекс только для указанных рецептов'''
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return
+    if connection.vendor == 'postgresql':
+        Recipe.objects.filter(id__in=recipe_ids).update(
+            search_vector=search_vector()
+        )
+        return
+    placeholders = ', '.join(['%s'] * len(recipe_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})',
+            recipe_ids
+        )
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, text) '
+            f'SELECT id, name, text FROM {Recipe._meta.db_table} '
+            f'WHERE id IN ({placeholders})',
+            recipe_ids
+        )
+
+
+def remove_from_index(recipe_id):
+    '''В PostgreSQL вектор удаляется вместе со строкой рецепта'''
+    if connection.vendor == 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', (recipe_id,)
+        )
+
+
+def rebuild_index():
+    '''Индекс для всех рецептов, например после bulk_create'''
+    if connection.vendor == 'postgresql':
+        Recipe.objects.update(search_vector=search_vector())
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, text) '
+            f'SELECT id, name, text FROM {Recipe._meta.db_table}'
+        )
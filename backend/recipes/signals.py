@@ -0,0 +1,117 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from users.models import User
+
+from .cart_totals import ingredients_changed_in_recipe, recipes_changed_in_cart
+from .counters import change_counter
+from .images import delete_variant_files
+from .models import Bookmark, Cart, IngredientForRecipe, Recipe
+from .search import remove_from_index, update_index
+
+# Поля рецепта, которые попадают в поисковый индекс
+SEARCH_FIELDS = {'name', 'text'}
+
+# Модели, сигналы строк которых выключены внутри bulk_changes()
+muted_senders = ContextVar('muted_senders', default=frozenset())
+
+
+@contextmanager
+def bulk_changes(*models):
+    '''Меняем много строк models сразу: счетчики, кэш и корзины
+    вызывающий код обновляет сам один раз, а не сигналами на каждую строку
+    '''
+    token = muted_senders.set(muted_senders.get() | set(models))
+    try:
+        yield
+    finally:
+        muted_senders.reset(token)
+
+
+@receiver(post_save, sender=Bookmark)
+def bookmark_created(instance, created, **kwargs):
+    if created:
+        change_counter(Recipe, instance.recipe_id, 'favorites_count', 1)
+
+
+@receiver(post_delete, sender=Bookmark)
+def bookmark_deleted(sender, instance, **kwargs):
+    if sender in muted_senders.get():
+        return
+    change_counter(Recipe, instance.recipe_id, 'favorites_count', -1)
+
+
+@receiver(post_save, sender=Cart)
+def cart_created(instance, created, **kwargs):
+    if created:
+        change_counter(Recipe, instance.recipe_id, 'carts_count', 1)
+
+
+@receiver(post_delete, sender=Cart)
+def cart_deleted(sender, instance, **kwargs):
+    if sender in muted_senders.get():
+        return
+    change_counter(Recipe, instance.recipe_id, 'carts_count', -1)
+
+
+@receiver(post_save, sender=Cart)
+def cart_totals_added(instance, created, **kwargs):
+    if created:
+        recipes_changed_in_cart(instance.user_id, [instance.recipe_id])
+
+
+@receiver(post_delete, sender=Cart)
+def cart_totals_removed(sender, instance, **kwargs):
+    if sender in muted_senders.get():
+        return
+    recipes_changed_in_cart(instance.user_id, [instance.recipe_id])
+
+
+@receiver(post_save, sender=IngredientForRecipe)
+def cart_totals_ingredient_saved(sender, instance, created, **kwargs):
+    '''У измененной строки мог поменяться сам ингредиент,
+    тогда пересчитываем корзины целиком
+    '''
+    if sender in muted_senders.get():
+        return
+    ingredient_ids = [instance.ingredient_id] if created else None
+    ingredients_changed_in_recipe(instance.recipe_id, ingredient_ids)
+
+
+@receiver(post_delete, sender=IngredientForRecipe)
+def cart_totals_ingredient_deleted(sender, instance, **kwargs):
+    if sender in muted_senders.get():
+        return
+    ingredients_changed_in_recipe(instance.recipe_id, [instance.ingredient_id])
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_created(instance, created, **kwargs):
+    if created and instance.author_id:
+        change_counter(User, instance.author_id, 'recipes_count', 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(instance, **kwargs):
+    if instance.author_id:
+        change_counter(User, instance.author_id, 'recipes_count', -1)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_search_index(instance, created, update_fields, **kwargs):
+    '''Индекс обновляем только если менялись название или описание'''
+    if created or update_fields is None or SEARCH_FIELDS & set(update_fields):
+        update_index([instance.pk])
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_search_index_deleted(instance, **kwargs):
+    remove_from_index(instance.pk)
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_variants_deleted(instance, **kwargs):
+    '''Копии картинки больше никому не нужны'''
+    delete_variant_files((instance.image_variants or {}).values())
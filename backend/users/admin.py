@@ -10,7 +10,8 @@ class UserAdmin(admin.ModelAdmin):
         'password',
         'first_name',
         'last_name',
-        'email'
+        'email',
+        'recipes_count'
     )
     list_filter = ('username',)
     empty_value_display = 'нет информации'
@@ -33,6 +33,11 @@ class User(AbstractUser):
         max_length=150,
         verbose_name='Пароль'
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество рецептов'
+    )
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = [
         'password',